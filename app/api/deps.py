@@ -1,40 +1,76 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import AsyncSessionLocal
+from app.core.replicas import get_read_db, replica_router
 from app.core.security import verify_token
-from app.services.user_service import UserService
-from app.models.user import User
+from app.services.user_service import Principal, UserService, principal_cache
 
 security = HTTPBearer()
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def authenticate_token(token: str, db: AsyncSession) -> Optional[Principal]:
+    """Principal of a valid access token, or None"""
+    # Tokens verified recently skip the JWT decode and the user lookup
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     
-    token = credentials.credentials
     payload = verify_token(token)
     
     if payload is None:
-        raise credentials_exception
+        return None
     
     email: str = payload.get("sub")
     if email is None:
-        raise credentials_exception
+        return None
     
-    user = UserService.get_user_by_email(db, email=email)
+    user = await UserService.get_user_by_email(db, email=email)
+    if user is None and replica_router.is_replica(db):
+        # The account may be newer than the replica's last replayed transaction
+        async with AsyncSessionLocal() as primary:
+            user = await UserService.get_user_by_email(primary, email=email)
     if user is None:
+        return None
+    
+    principal = Principal.from_user(user)
+    principal_cache.set(token, principal, payload.get("exp"))
+    return principal
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_read_db)
+) -> Principal:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    principal = await authenticate_token(credentials.credentials, db)
+    if principal is None:
         raise credentials_exception
     
-    return user
+    return principal
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_user_read_db(
+    request: Request,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Read-only session for the current user's data.
+    
+    Reads go to the primary while the replica has not replayed the last
+    write of this client, so they never see a state older than its own changes.
+    """
+    if replica_router.behind_client(db, request):
+        replica_router.read_your_writes += 1
+        async with AsyncSessionLocal() as primary:
+            yield primary
+    else:
+        yield db
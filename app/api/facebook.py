@@ -1,21 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.api.deps import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.conditional import make_etag, not_modified, not_modified_response, set_etag
+from app.core.database import get_async_db
+from app.core.replicas import replica_router
+from app.api.deps import get_current_user, get_user_read_db
 from app.services.facebook_service import FacebookService
 from app.schemas.facebook import FacebookConnectRequest, FacebookConnectResponse, FacebookPageResponse, FacebookAuthResponse, FacebookConnectionResponse
 from app.models.facebook_page import FacebookPage
-from app.models.user import User
+from app.services.user_service import Principal
+import logging
 import secrets
 import time
 
 router = APIRouter(prefix="/facebook", tags=["facebook"])
+logger = logging.getLogger(__name__)
 
 @router.get("/auth", response_model=FacebookAuthResponse)
 async def get_facebook_auth_url(
     redirect_uri: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Get Facebook OAuth URL for connecting a page.
@@ -32,34 +37,30 @@ async def get_facebook_auth_url(
 @router.post("/connect", response_model=FacebookConnectResponse)
 async def connect_facebook_page(
     request: FacebookConnectRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     try:
         # Exchange code for access token
-        print("started...")
-        token_info = FacebookService.get_access_token(request.code, request.redirect_uri)
+        token_info = await FacebookService.get_access_token(request.code, request.redirect_uri)
         access_token = token_info["access_token"]
-        print("access_token", access_token)
         # Exchange for long-lived token
-        long_lived_token_info = FacebookService.get_long_lived_token(access_token)
+        long_lived_token_info = await FacebookService.get_long_lived_token(access_token)
         long_lived_token = long_lived_token_info["access_token"]
-        print("long_lived_token", long_lived_token)
         # Get page information
-        pages_info = FacebookService.get_page_access_token(long_lived_token)
-        print("pages_info", pages_info)
+        pages_info = await FacebookService.get_page_access_token(long_lived_token)
         if not pages_info.get("data"):
             raise HTTPException(status_code=400, detail="No Facebook pages found")
         
         # Use the first page for now (can be modified to handle multiple pages)
         page = pages_info["data"][0]
-        print("first page", page)
+        logger.info("Connecting Facebook page %s for user %d (%d pages granted)", page["id"], current_user.id, len(pages_info["data"]))
         # Check if page is already connected
-        existing_page = db.query(FacebookPage).filter(
+        existing_page = await db.scalar(select(FacebookPage).where(
             FacebookPage.id == page["id"],
             FacebookPage.user_id == current_user.id
-        ).first()
-        print("existing_page", existing_page)
+        ))
         if existing_page:
             if existing_page.is_active:
                 return FacebookConnectResponse(
@@ -68,7 +69,8 @@ async def connect_facebook_page(
                 )
             existing_page.is_active = True
             existing_page.access_token = page["access_token"]
-            db.commit()
+            await db.commit()
+            await replica_router.mark_write(response, db)
             return FacebookConnectResponse(
                 success=True,
                 page=FacebookPageResponse.from_orm(existing_page),
@@ -86,8 +88,9 @@ async def connect_facebook_page(
         )
         
         db.add(new_page)
-        db.commit()
-        db.refresh(new_page)
+        await db.commit()
+        await db.refresh(new_page)
+        await replica_router.mark_write(response, db)
         
         return FacebookConnectResponse(
             success=True,
@@ -95,20 +98,23 @@ async def connect_facebook_page(
             message="Page connected successfully"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/disconnect/{page_id}", response_model=FacebookConnectResponse)
 async def disconnect_facebook_page(
     page_id: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ):
-    page = db.query(FacebookPage).filter(
+    page = await db.scalar(select(FacebookPage).where(
         FacebookPage.id == page_id,
         FacebookPage.user_id == current_user.id,
         FacebookPage.is_active == True
-    ).first()
+    ))
     
     if not page:
         raise HTTPException(status_code=404, detail="Facebook page not found or already disconnected")
@@ -116,7 +122,8 @@ async def disconnect_facebook_page(
     # Revoke access token
     if FacebookService.disconnect_page(page.id, page.access_token):
         page.is_active = False
-        db.commit()
+        await db.commit()
+        await replica_router.mark_write(response, db)
         return FacebookConnectResponse(
             success=True,
             message="Page disconnected successfully"
@@ -126,19 +133,34 @@ async def disconnect_facebook_page(
 
 @router.get("/connection", response_model=FacebookConnectionResponse)
 async def get_facebook_connection(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_user_read_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Get the user's Facebook page connection status.
     Returns connected=1 if an active connection exists, connected=0 otherwise.
-    Includes a timestamp for client-side caching.
+    Includes a timestamp for client-side caching. The ETag follows the
+    connected page and its access token, so polls get a 304 until the page
+    or the token it is reached with changes.
     """
     # Query for the most recent active Facebook page
-    active_page = db.query(FacebookPage).filter(
+    active_page = await db.scalar(select(FacebookPage).where(
         FacebookPage.user_id == current_user.id,
         FacebookPage.is_active == True
-    ).order_by(FacebookPage.id.desc()).first()
+    ).order_by(FacebookPage.id.desc()).limit(1))
+    
+    etag = make_etag(
+        "facebook_connection",
+        current_user.id,
+        # The token is only hashed into the tag; a reconnect or refresh replaces it
+        *((active_page.id, active_page.name, active_page.picture_url, active_page.is_active, active_page.access_token)
+          if active_page else ())
+    )
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
     
     return FacebookConnectionResponse(
         connected=1 if active_page else 0,
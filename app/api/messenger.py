@@ -1,20 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import Any, Dict, List, Optional
+import asyncio
 import hmac
 import hashlib
-from datetime import datetime
+import logging
+import pytz
+from datetime import datetime, timedelta
 
-from app.core.database import get_db
-from app.api.deps import get_current_user
+from app.core.database import get_async_db, AsyncSessionLocal
+from app.api.deps import authenticate_token, get_current_user, get_user_read_db
 from app.services.messenger_service import MessengerService
-from app.models.user import User
+from app.services.webhook_inbox_service import WebhookInboxService
+from app.services.send_pipeline import send_pipeline, SendJob, SendQueueFull
+from app.services.user_service import Principal
 from app.models.chat import Chat, Message
-from app.schemas.chat import ChatResponse, MessageResponse, SendMessageRequest
+from app.models.facebook_page import FacebookPage
+from app.schemas.chat import ChatResponse, MessageResponse, MessagePage, InboxPage, SendMessageRequest, BulkSendRequest
+from app.core import json_codec
 from app.core.config import settings
+from app.core.logs import SampledLogger
+from app.core.conditional import make_etag, not_modified, not_modified_response, set_etag
+from app.core.pagination import encode_cursor, decode_cursor, encode_watermark, decode_watermark
+from app.core.replicas import replica_router
 from app.core.websocket import manager
+from app.core.webhook_queue import webhook_queue, WebhookQueueFull
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+webhook_log = SampledLogger(logger, settings.LOG_SAMPLE_RATE)
 
 # Your Facebook app secret from environment variables
 FB_APP_SECRET = settings.FACEBOOK_APP_SECRET
@@ -46,125 +63,483 @@ async def verify_webhook(request: Request):
         return Response(status_code=403)
 
 @router.post("/webhook")
-async def webhook(request: Request, db: Session = Depends(get_db)):
+async def webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Handle incoming webhook events from Facebook"""
     payload = await request.body()
     
     if not verify_facebook_signature(request, payload):
+        webhook_log.warning("webhook_rejected", reason="signature", bytes=len(payload))
         raise HTTPException(status_code=403, detail="Invalid signature")
-    print("Signature verified...")
-    body = await request.json()
-    print(f"body: {body}")
-    if body.get("object") == "page":
-        messenger_service = MessengerService(db)
+    
+    # The verified bytes are parsed once, and the parsed body is what the workers process
+    try:
+        body = json_codec.loads(payload)
+    except ValueError:
+        webhook_log.warning("webhook_rejected", reason="json", bytes=len(payload))
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    
+    if isinstance(body, dict) and body.get("object") == "page":
+        # Persist the raw delivery first so it survives a crash before processing
+        event_id = await WebhookInboxService.record(db, payload)
+        webhook_log.info("webhook_received", event_id=event_id, entries=len(body.get("entry", [])), bytes=len(payload))
         
-        for entry in body.get("entry", []):
-            page_id = entry.get("id")
-            message = await messenger_service.handle_incoming_message(entry, page_id)
-            if message:
-                # Broadcast the new message to connected clients
-                await manager.broadcast_to_chat(message.chat_id, {
-                    "type": "new_message",
-                    "data": {
-                        "id": message.id,
-                        "content": message.content,
-                        "message_type": message.message_type,
-                        "fb_message_id": message.fb_message_id,
-                        "timestamp": message.timestamp.isoformat()
-                    }
-                })
+        # Acknowledge right away, the webhook workers do the processing
+        try:
+            webhook_queue.enqueue({"event_id": event_id, "body": body})
+        except WebhookQueueFull:
+            if webhook_queue.overflow_policy == "reject":
+                # Facebook redelivers on non-2xx responses once the backlog drains
+                raise HTTPException(status_code=503, detail="Webhook queue is full")
+            # defer: the event stays pending in the inbox for the replay command
         
         return {"success": True}
     
     return Response(status_code=404)
 
+async def process_webhook(item: Dict[str, Any]):
+    """Process a queued webhook delivery (run by the webhook workers)"""
+    event_id = item["event_id"]
+    
+    async with AsyncSessionLocal() as db:
+        # Skip events already handled (or being handled) by a replay
+        if not await WebhookInboxService.claim(db, [event_id]):
+            return
+        
+        try:
+            incoming = await WebhookInboxService.process(db, [event_id], [item["body"]])
+        except Exception as e:
+            await db.rollback()
+            await WebhookInboxService.mark_failed(db, [event_id], str(e))
+            raise
+    
+    await WebhookInboxService.broadcast(incoming)
+
 @router.get("/chats", response_model=List[ChatResponse])
 async def get_chats(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    since: Optional[str] = None,
+    db: AsyncSession = Depends(get_user_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Get all chats for the current user.
+    
+    The X-Sync-Token header is a watermark: passed back as ``since`` it
+    returns only the chats changed after it, each with only its changed
+    messages. Unchanged polls get a 304 for their ETag without loading
+    any chat or message.
+    """
+    try:
+        changed_after = (
+            decode_watermark(since) - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS) if since else None
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since watermark")
+    
+    # Every change to a chat bumps its last_seq and updated_at
+    count, last_change, total_seq = (await db.execute(
+        select(func.count(Chat.id), func.max(Chat.updated_at), func.coalesce(func.sum(Chat.last_seq), 0))
+        .where(Chat.user_id == current_user.id)
+    )).one()
+    etag = make_etag("chats", current_user.id, count, last_change, total_seq, since)
+    headers = {"X-Sync-Token": encode_watermark(last_change)} if last_change else {}
+    if not_modified(request, etag):
+        return not_modified_response(etag, headers)
+    set_etag(response, etag)
+    response.headers.update(headers)
+    
+    # Messages are part of the response; lazy loading is not available under asyncio
+    query = select(Chat).where(Chat.user_id == current_user.id)
+    if changed_after is None:
+        query = query.options(selectinload(Chat.messages))
+    else:
+        query = query.where(Chat.updated_at > changed_after).options(
+            selectinload(Chat.messages.and_(Message.updated_at > changed_after))
+        )
+    chats = await db.scalars(query)
+    return chats.all()
+
+@router.get("/inbox", response_model=InboxPage)
+async def get_inbox(
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.INBOX_PAGE_SIZE, ge=1, le=settings.INBOX_PAGE_MAX),
+    db: AsyncSession = Depends(get_user_read_db),
+    current_user: Principal = Depends(get_current_user)
 ):
-    """Get all chats for the current user"""
-    chats = db.query(Chat).filter(Chat.user_id == current_user.id).all()
-    return chats
+    """Get chat summaries for the inbox, most recent activity first.
+    
+    Served from the last_message_* columns of the chats, so a page is a
+    single indexed query however long the conversations are.
+    """
+    query = select(Chat).where(
+        Chat.user_id == current_user.id,
+        Chat.last_message_at.isnot(None)
+    )
+    if cursor:
+        try:
+            position = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(Chat.last_message_at, Chat.id) < tuple_(*position))
+    
+    chats = (await db.scalars(
+        query.order_by(Chat.last_message_at.desc(), Chat.id.desc()).limit(limit + 1)
+    )).all()
+    
+    next_cursor = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1].last_message_at, chats[-1].id)
+    
+    return {
+        "chats": chats,
+        "next_cursor": next_cursor
+    }
 
-@router.get("/chats/{chat_id}/messages", response_model=List[MessageResponse])
+@router.get("/chats/{chat_id}/messages", response_model=MessagePage)
 async def get_messages(
     chat_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(settings.MESSAGES_PAGE_SIZE, ge=1, le=settings.MESSAGES_PAGE_MAX),
+    db: AsyncSession = Depends(get_user_read_db),
+    current_user: Principal = Depends(get_current_user)
 ):
-    """Get all messages for a specific chat"""
-    chat = db.query(Chat).filter(
+    """Get a page of messages for a specific chat.
+    
+    Without cursors the most recent messages are returned. Pages are keyed
+    on (timestamp, id), so every page costs the same however long the chat is.
+    With ``since`` (a ``last_seq``) only the messages created or updated
+    after it are returned, in change order. The ETag follows the chat's
+    last_seq, so an unchanged poll gets a 304 without reading messages.
+    """
+    if sum(1 for position in (before, after, since) if position is not None) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of before, after and since")
+    
+    chat = await db.scalar(select(Chat).where(
         Chat.id == chat_id,
         Chat.user_id == current_user.id
-    ).first()
+    ))
     
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    messages = db.query(Message).filter(Message.chat_id == chat_id).all()
-    return messages
+    etag = make_etag("messages", chat.id, chat.last_seq, before, after, since, limit)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+    
+    if since is not None:
+        messages = await MessengerService(db).get_messages_since(chat.id, since, limit + 1)
+        has_more = len(messages) > limit
+        return {
+            "messages": messages[:limit],
+            "has_more": has_more,
+            # A truncated page resumes after its last change, not the chat's latest
+            "last_seq": messages[limit - 1].seq if has_more else chat.last_seq
+        }
+    
+    try:
+        cursor = decode_cursor(before or after) if (before or after) else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    position = tuple_(Message.timestamp, Message.id)
+    query = select(Message).where(Message.chat_id == chat_id)
+    if after:
+        query = query.where(position > tuple_(*cursor)).order_by(Message.timestamp, Message.id)
+    else:
+        if cursor:
+            query = query.where(position < tuple_(*cursor))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+    
+    # Fetch one extra row to know whether another page exists
+    messages = list(await db.scalars(query.limit(limit + 1)))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+    
+    before_cursor = after_cursor = None
+    if messages:
+        oldest, newest = messages[0], messages[-1]
+        if after or has_more:
+            before_cursor = encode_cursor(oldest.timestamp, oldest.id)
+        after_cursor = encode_cursor(newest.timestamp, newest.id)
+    elif cursor:
+        # Nothing newer yet: keep polling from the same position
+        after_cursor = after
+    
+    return {
+        "messages": messages,
+        "before_cursor": before_cursor,
+        "after_cursor": after_cursor,
+        "has_more": has_more,
+        "last_seq": chat.last_seq
+    }
 
-@router.post("/chats/{chat_id}/messages", response_model=MessageResponse)
+@router.post("/chats/{chat_id}/messages", response_model=MessageResponse, status_code=202)
 async def send_message(
     chat_id: int,
     message: SendMessageRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ):
-    """Send a message to a Facebook user"""
-    chat = db.query(Chat).filter(
+    """Queue a message to a Facebook user.
+    
+    The message is returned as pending right away; its final status
+    (sent or failed) is pushed to the chat as a message_status event.
+    """
+    chat = await db.scalar(select(Chat).where(
         Chat.id == chat_id,
         Chat.user_id == current_user.id
-    ).first()
+    ))
     
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
     messenger_service = MessengerService(db)
-    message_id = messenger_service.send_message(chat_id, message.content)
+    page = await messenger_service.get_chat_page(chat)
+    if not page:
+        raise HTTPException(status_code=400, detail="No Facebook page connected")
     
-    if not message_id:
-        raise HTTPException(status_code=500, detail="Failed to send message")
-    
-    # Get the newly created message
-    new_message = db.query(Message).filter(Message.fb_message_id == message_id).first()
+    new_message = await messenger_service.create_pending_message(chat_id, message.content)
+    await replica_router.mark_write(response, db)
     
     # Broadcast the new message to connected clients
-    await manager.broadcast_to_chat(chat_id, {
+    await manager.broadcast_to_chat(chat_id, current_user.id, {
         "type": "new_message",
-        "data": {
-            "id": new_message.id,
-            "content": new_message.content,
-            "message_type": new_message.message_type,
-            "fb_message_id": new_message.fb_message_id,
-            "timestamp": new_message.timestamp.isoformat()
-        }
-    })
+        "data": MessengerService.message_payload(new_message)
+    }, new_message.seq)
+    
+    try:
+        send_pipeline.enqueue(SendJob(
+            message_id=new_message.id,
+            chat_id=chat_id,
+            user_id=current_user.id,
+            page_id=page.id,
+            page_access_token=page.access_token,
+            recipient_id=chat.fb_user_id,
+            text=new_message.content,
+            claimed_at=new_message.claimed_at
+        ))
+    except SendQueueFull:
+        failed = await messenger_service.complete_outgoing_message(new_message.id, chat_id, error="Send queue is full")
+        if failed:
+            await manager.broadcast_to_chat(chat_id, current_user.id, {
+                "type": "message_status",
+                "data": MessengerService.message_payload(failed)
+            }, failed.seq)
+        raise HTTPException(status_code=503, detail="Too many messages queued for this page")
     
     return new_message
 
+@router.post("/chats/bulk-messages")
+async def send_bulk_message(
+    request: BulkSendRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Send the same message to many chats at once.
+    
+    Targets either explicit chat_ids or every chat matching the filter.
+    Progress is streamed back as newline-delimited JSON: one "accepted" line,
+    one "result" line per chat as its send completes, then a "summary" line.
+    Every send is queued before the response starts, so they all go out even
+    if the client stops reading.
+    """
+    if (request.chat_ids is None) == (request.filter is None):
+        raise HTTPException(status_code=400, detail="Provide either chat_ids or filter")
+    
+    # Validate ownership of every target in one query
+    query = select(Chat).where(Chat.user_id == current_user.id)
+    if request.chat_ids is not None:
+        query = query.where(Chat.id.in_(request.chat_ids))
+    else:
+        # Message timestamps are stored as IST wall-clock time
+        cutoff = datetime.now(pytz.timezone('Asia/Kolkata')).replace(tzinfo=None) - timedelta(
+            hours=request.filter.active_within_hours
+        )
+        query = query.where(Chat.last_message_at >= cutoff)
+    # Recipient PSID by chat id
+    recipients = {
+        chat.id: chat.fb_user_id
+        for chat in await db.scalars(query.limit(settings.BULK_SEND_MAX_CHATS + 1))
+    }
+    
+    if len(recipients) > settings.BULK_SEND_MAX_CHATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Bulk sends are limited to {settings.BULK_SEND_MAX_CHATS} chats"
+        )
+    not_found = [chat_id for chat_id in request.chat_ids or [] if chat_id not in recipients]
+    
+    page = await db.scalar(select(FacebookPage).where(FacebookPage.user_id == current_user.id).limit(1))
+    if recipients and not page:
+        raise HTTPException(status_code=400, detail="No Facebook page connected")
+    page_id, page_access_token = (page.id, page.access_token) if page else (None, None)
+    
+    # One bulk insert for all pending messages
+    messenger_service = MessengerService(db)
+    new_messages = await messenger_service.create_pending_messages(list(recipients), request.content) if recipients else []
+    for new_message in new_messages:
+        await manager.broadcast_to_chat(new_message.chat_id, current_user.id, {
+            "type": "new_message",
+            "data": MessengerService.message_payload(new_message)
+        }, new_message.seq)
+    
+    def result(new_message, payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "type": "result",
+            "chat_id": new_message.chat_id,
+            "message_id": new_message.id,
+            "status": payload["status"] if payload else "failed",
+            "fb_message_id": payload["fb_message_id"] if payload else None
+        }
+    
+    # Queue every send before answering, so they go out even if the client never reads the stream
+    pending: Dict[asyncio.Future, Any] = {}
+    refused = []
+    for new_message in new_messages:
+        job = SendJob(
+            message_id=new_message.id,
+            chat_id=new_message.chat_id,
+            user_id=current_user.id,
+            page_id=page_id,
+            page_access_token=page_access_token,
+            recipient_id=recipients[new_message.chat_id],
+            text=request.content,
+            claimed_at=new_message.claimed_at
+        )
+        try:
+            pending[send_pipeline.enqueue(job, wait=True)] = new_message
+        except SendQueueFull:
+            await send_pipeline.complete(job, None, "Send queue is full")
+            refused.append(result(new_message, None))
+    
+    async def progress():
+        try:
+            yield json_codec.dumps({"type": "accepted", "total": len(new_messages), "not_found": not_found}) + "\n"
+            
+            sent, failed = 0, len(refused)
+            for line in refused:
+                yield json_codec.dumps(line) + "\n"
+            
+            waiting = set(pending)
+            while waiting:
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    new_message = pending[future]
+                    try:
+                        line = result(new_message, future.result())
+                    except Exception as e:
+                        logger.error("Bulk send to chat %d failed: %s", new_message.chat_id, e)
+                        line = result(new_message, None)
+                    if line["status"] == "sent":
+                        sent += 1
+                    else:
+                        failed += 1
+                    yield json_codec.dumps(line) + "\n"
+            
+            yield json_codec.dumps({"type": "summary", "sent": sent, "failed": failed, "not_found": len(not_found)}) + "\n"
+        finally:
+            # The client went away: the sends carry on, only their reporting stops
+            for future in pending:
+                future.cancel()
+    
+    response = StreamingResponse(progress(), media_type="application/x-ndjson")
+    await replica_router.mark_write(response, db)
+    return response
+
+@router.websocket("/ws")
+async def user_websocket_endpoint(websocket: WebSocket, token: Optional[str] = None):
+    """Authenticated WebSocket receiving the events of every chat of the current user.
+    
+    Pass the access token as the ``token`` query parameter, browsers cannot
+    set headers on WebSocket requests. Every event carries its chat_id, and
+    conversations started by customers arrive as new_chat events.
+    """
+    # Short-lived session: the socket must not keep a pool connection
+    async with replica_router.session() as db:
+        principal = await authenticate_token(token, db) if token else None
+    if principal is None or not principal.is_active:
+        await websocket.close(code=4001, reason="Not authenticated")
+        return
+    
+    connection = await manager.connect(websocket, principal.id)
+    if connection is None:
+        return
+    try:
+        await connection.receive()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await manager.disconnect(connection)
+
+async def replay_missed(chat: Chat, last_seq: int) -> List[str]:
+    """Frames of the changes to a chat after ``last_seq``, from the replay buffer or the database"""
+    frames = manager.replay(chat.id, chat.user_id, last_seq, chat.last_seq)
+    if frames is not None:
+        return frames
+    
+    async with AsyncSessionLocal() as db:
+        messages = await MessengerService(db).get_messages_since(chat.id, last_seq, settings.WS_REPLAY_MAX_MESSAGES + 1)
+    if not messages:
+        return []
+    if len(messages) > settings.WS_REPLAY_MAX_MESSAGES:
+        # Too far behind: cheaper for the client to reload the chat
+        return [json_codec.dumps({"chat_id": chat.id, "type": "resync_required"})]
+    return [json_codec.dumps({
+        "chat_id": chat.id,
+        "seq": messages[-1].seq,
+        "type": "replay",
+        "data": [MessengerService.message_payload(message) for message in messages]
+    })]
+
 @router.websocket("/ws/{chat_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     chat_id: int,
-    db: Session = Depends(get_db)
+    token: Optional[str] = None,
+    last_seq: Optional[int] = None
 ):
-    """WebSocket endpoint for real-time chat updates"""
+    """WebSocket endpoint for real-time chat updates.
+    
+    Authenticated like ``/ws`` with the ``token`` query parameter. Clients
+    reconnecting with the ``seq`` of the last event they applied as
+    ``last_seq`` first get the changes they missed.
+    """
     try:
-        # Verify chat exists
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()
+        # Verify the user owns the chat, releasing the pool connection before the socket loop
+        # (on the primary: clients open chat sockets right after new_chat events)
+        async with AsyncSessionLocal() as db:
+            principal = await authenticate_token(token, db) if token else None
+            if principal is None or not principal.is_active:
+                await websocket.close(code=4001, reason="Not authenticated")
+                return
+            chat = await db.scalar(
+                select(Chat).where(Chat.id == chat_id, Chat.user_id == principal.id)
+            )
         if not chat:
             await websocket.close(code=4004, reason="Chat not found")
             return
 
-        await manager.connect(websocket, chat_id)
+        connection = await manager.connect(websocket, chat.user_id, chat_id, hold=last_seq is not None)
+        if connection is None:
+            return
         try:
-            while True:
-                # Keep the connection alive and handle any incoming messages
-                data = await websocket.receive_text()
+            if last_seq is not None:
+                await connection.resume(await replay_missed(chat, last_seq))
+            # Keep the connection alive and answer heartbeats
+            await connection.receive()
         except WebSocketDisconnect:
-            manager.disconnect(websocket, chat_id)
-    except Exception as e:
+            pass
+        finally:
+            await manager.disconnect(connection)
+    except Exception:
         if not websocket.client_state.DISCONNECTED:
             await websocket.close(code=4000) 
\ No newline at end of file
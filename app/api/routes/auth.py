@@ -1,23 +1,22 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import get_async_db
 from app.core.security import create_access_token
 from app.core.config import settings
 from app.schemas.user import UserCreate, UserLogin, UserResponse, Token
-from app.services.user_service import UserService
+from app.services.user_service import Principal, UserService
 from app.api.deps import get_current_active_user
-from app.models.user import User
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(
+async def register_user(
     user: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Check if user already exists
-    db_user = UserService.get_user_by_email(db, email=user.email)
+    db_user = await UserService.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -26,7 +25,7 @@ def register_user(
     
     # Create new user
     try:
-        db_user = UserService.create_user(db=db, user=user)
+        db_user = await UserService.create_user(db=db, user=user)
         return db_user
     except Exception as e:
         raise HTTPException(
@@ -35,11 +34,11 @@ def register_user(
         )
 
 @router.post("/login", response_model=Token)
-def login_user(
+async def login_user(
     user_credentials: UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = UserService.authenticate_user(
+    user = await UserService.authenticate_user(
         db, user_credentials.email, user_credentials.password
     )
     if not user:
@@ -60,11 +59,11 @@ def login_user(
     }
 
 @router.get("/me", response_model=UserResponse)
-def read_current_user(current_user: User = Depends(get_current_active_user)):
+def read_current_user(current_user: Principal = Depends(get_current_active_user)):
     return current_user
 
 @router.get("/protected")
-def protected_route(current_user: User = Depends(get_current_active_user)):
+def protected_route(current_user: Principal = Depends(get_current_active_user)):
     return {
         "message": f"Hello {current_user.email}, this is a protected route!",
         "user_id": current_user.id
@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+class LRUCache(Generic[V]):
+    """Bounded in-process least-recently-used cache with hit/miss counters"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, V]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            self._evicted(evicted)
+            self.evictions += 1
+
+    def _evicted(self, key: Hashable):
+        """Called for every key dropped to stay within maxsize"""
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        return self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class TTLCache(LRUCache[V]):
+    """LRU cache whose entries also expire ``ttl`` seconds after they are set"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.expired = 0
+        self._expires: Dict[Hashable, float] = {}
+
+    def get(self, key: Hashable) -> Optional[V]:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.pop(key)
+            self.expired += 1
+        return super().get(key)
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None):
+        """Store a value for ``ttl`` seconds (the cache default if not given)"""
+        self._expires[key] = time.monotonic() + (self.ttl if ttl is None else ttl)
+        super().set(key, value)
+
+    def _evicted(self, key: Hashable):
+        self._expires.pop(key, None)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        self._expires.pop(key, None)
+        return super().pop(key)
+
+    def clear(self):
+        self._expires.clear()
+        super().clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["expired"] = self.expired
+        return stats
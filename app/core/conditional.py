@@ -0,0 +1,30 @@
+import hashlib
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+def make_etag(*versions: Any) -> str:
+    """Weak ETag from the version values a response is derived from"""
+    raw = "|".join(str(version) for version in versions).encode("utf-8")
+    return f'W/"{hashlib.blake2b(raw, digest_size=12).hexdigest()}"'
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names ``etag`` (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (tag[2:] if tag.startswith("W/") else tag) == opaque
+        for tag in (part.strip() for part in header.split(","))
+    )
+
+def not_modified_response(etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache", **(headers or {})})
+
+def set_etag(response: Response, etag: str):
+    # Clients must revalidate every time, but may reuse the body on 304
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
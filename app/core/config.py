@@ -1,15 +1,29 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Facebook Helpdesk API"
     VERSION: str = "1.0.0"
     API_V1_STR: str = "/api/v1"
     
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_SAMPLE_RATE: float = 0.01  # Fraction of hot-path debug/info events logged (e.g. one line per 100 webhooks)
+    
     # Security
     SECRET_KEY: str = "your-super-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL_SECONDS: float = 60.0
+    
+    # Password hashing
+    PASSWORD_HASH_SCHEME: str = "argon2"  # "argon2" (argon2id) or "bcrypt"; other hashes are upgraded on login
+    PASSWORD_HASH_CONCURRENCY: int = 4  # Hashes computed at once, per worker
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536  # KiB
+    ARGON2_PARALLELISM: int = 1
+    BCRYPT_ROUNDS: int = 12
     
     # PostgreSQL Database
     POSTGRES_SERVER: str = "localhost"
@@ -17,15 +31,98 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = "password"
     POSTGRES_DB: str = "facebook_helpdesk"
     POSTGRES_PORT: str = "5432"
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    
+    # Read replicas
+    DATABASE_REPLICA_URLS: str = ""  # Comma-separated postgresql+asyncpg:// URLs, empty to read from the primary
+    REPLICA_MAX_LAG_SECONDS: float = 5.0
+    REPLICA_LAG_CHECK_INTERVAL: float = 2.0
+    READ_YOUR_WRITES_SECONDS: float = 10.0
     
     FACEBOOK_APP_ID: str = ""
     FACEBOOK_APP_SECRET: str = ""
     FACEBOOK_VERIFY_TOKEN: str = "jaygodara"
     
+    # Graph API client
+    GRAPH_API_URL: str = "https://graph.facebook.com/v18.0"
+    GRAPH_HTTP2: bool = True  # Used when the h2 package is installed
+    GRAPH_MAX_CONNECTIONS: int = 100
+    GRAPH_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    GRAPH_KEEPALIVE_EXPIRY: float = 30.0
+    GRAPH_CONNECT_TIMEOUT: float = 3.0
+    GRAPH_SEND_TIMEOUT: float = 10.0
+    GRAPH_PROFILE_TIMEOUT: float = 5.0
+    GRAPH_OAUTH_TIMEOUT: float = 10.0
+    GRAPH_BATCH_TIMEOUT: float = 30.0
+    GRAPH_BREAKER_FAILURE_THRESHOLD: int = 5
+    GRAPH_BREAKER_RESET_TIMEOUT: float = 30.0
+    GRAPH_CONCURRENCY_INITIAL: int = 20
+    GRAPH_CONCURRENCY_MIN: int = 1
+    GRAPH_CONCURRENCY_MAX: int = 100
+    
+    # Customer profiles
+    PROFILE_CACHE_SIZE: int = 10000
+    PROFILE_TTL_HOURS: int = 24
+    PROFILE_REFRESH_CONCURRENCY: int = 4
+    
+    # Outgoing messages
+    SEND_RATE_PER_PAGE: float = 20.0  # Messages per second
+    SEND_BURST_PER_PAGE: int = 40
+    SEND_WORKERS_PER_PAGE: int = 4
+    SEND_QUEUE_MAXSIZE: int = 1000  # Per worker
+    SEND_MAX_RETRIES: int = 3
+    SEND_RETRY_BASE_DELAY: float = 1.0
+    SEND_SHUTDOWN_TIMEOUT: float = 10.0
+    SEND_CLAIM_LEASE_SECONDS: int = 300  # Before another worker may take over a pending message
+    SEND_RECOVER_INTERVAL: float = 60.0
+    SEND_RECOVER_BATCH_SIZE: int = 500
+    BULK_SEND_MAX_CHATS: int = 1000
+    
+    # Pagination
+    MESSAGES_PAGE_SIZE: int = 50
+    MESSAGES_PAGE_MAX: int = 200
+    INBOX_PAGE_SIZE: int = 50
+    INBOX_PAGE_MAX: int = 200
+    INBOX_PREVIEW_LENGTH: int = 100
+    SYNC_OVERLAP_SECONDS: float = 5.0  # Delta syncs re-send changes this close to the watermark, which may have committed late
+    
+    # Real-time events
+    PUBSUB_BACKEND: str = "memory"  # "memory" for a single worker, "postgres" (LISTEN/NOTIFY) across workers
+    PUBSUB_RECONNECT_INTERVAL: float = 2.0
+    WS_SEND_QUEUE_SIZE: int = 100  # Frames queued per socket
+    WS_SLOW_CONSUMER_POLICY: str = "disconnect"  # "disconnect" or "drop"
+    WS_HEARTBEAT_INTERVAL: float = 25.0  # Seconds between server pings and idle sweeps
+    WS_IDLE_TIMEOUT: float = 75.0  # Sockets that sent frames before and are silent for longer are evicted
+    WS_MAX_CONNECTIONS: int = 10000  # Per worker
+    WS_MAX_CONNECTIONS_PER_USER: int = 20
+    WS_REPLAY_BUFFER_SIZE: int = 100  # Latest frames kept per chat for reconnecting clients
+    WS_REPLAY_CHATS: int = 10000  # Chats with a replay buffer, per worker
+    WS_REPLAY_MAX_MESSAGES: int = 500  # Beyond this many missed changes the client must reload
+    
+    # Webhook ingestion
+    WEBHOOK_QUEUE_MAXSIZE: int = 1000
+    WEBHOOK_WORKERS: int = 4
+    WEBHOOK_OVERFLOW_POLICY: str = "defer"  # "reject", "drop_oldest" or "defer"
+    WEBHOOK_SHUTDOWN_TIMEOUT: float = 10.0
+    WEBHOOK_DEDUP_CACHE_SIZE: int = 50000  # Recently stored message ids remembered to drop redeliveries
+    WEBHOOK_SWEEP_INTERVAL: float = 30.0  # Seconds between in-app replays of the inbox backlog, 0 to disable
+    WEBHOOK_SWEEP_MIN_AGE: float = 60.0  # Younger events are left to the queue workers
+    WEBHOOK_SWEEP_BATCH_SIZE: int = 500
+    WEBHOOK_SWEEP_MAX_ATTEMPTS: int = 5
+    
     @property
     def DATABASE_URL(self) -> str:
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
     
+    @property
+    def REPLICA_URLS(self) -> List[str]:
+        return [url.strip() for url in self.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+    
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -0,0 +1,219 @@
+import importlib.util
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.core import json_codec
+from app.core.config import settings
+from app.core.resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package (installed with httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+class GraphAPIError(Exception):
+    """Raised when a Graph API call times out, cannot connect or is failing fast"""
+
+class GraphClient:
+    """Shared async client for the Facebook Graph API.
+
+    One pooled ``httpx.AsyncClient`` is opened in the app lifespan and reused
+    by every service, so calls to graph.facebook.com ride on kept-alive
+    connections instead of paying a TCP+TLS handshake each time.
+
+    Every call belongs to an operation class (``send``, ``profile`` or
+    ``oauth``) with its own timeout, circuit breaker and adaptive concurrency
+    limit, so a degraded endpoint fails fast without holding up the others.
+    """
+
+    OPERATIONS = ("send", "profile", "oauth")
+    MAX_BATCH_SIZE = 50
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.timeouts = {
+            "send": settings.GRAPH_SEND_TIMEOUT,
+            "profile": settings.GRAPH_PROFILE_TIMEOUT,
+            "oauth": settings.GRAPH_OAUTH_TIMEOUT,
+        }
+        self.breakers = {
+            operation: CircuitBreaker(
+                operation,
+                failure_threshold=settings.GRAPH_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=settings.GRAPH_BREAKER_RESET_TIMEOUT
+            )
+            for operation in self.OPERATIONS
+        }
+        self.limiters = {
+            operation: AdaptiveLimiter(
+                initial=settings.GRAPH_CONCURRENCY_INITIAL,
+                min_limit=settings.GRAPH_CONCURRENCY_MIN,
+                max_limit=settings.GRAPH_CONCURRENCY_MAX
+            )
+            for operation in self.OPERATIONS
+        }
+        self.timed_out = {operation: 0 for operation in self.OPERATIONS}
+
+    async def start(self):
+        """Open the connection pool"""
+        if self._client is not None:
+            return
+
+        http2 = settings.GRAPH_HTTP2 and HTTP2_AVAILABLE
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.GRAPH_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(settings.GRAPH_SEND_TIMEOUT, connect=settings.GRAPH_CONNECT_TIMEOUT)
+        )
+        logger.info(
+            "Graph API client started (http2=%s, max_connections=%d)",
+            http2, settings.GRAPH_MAX_CONNECTIONS
+        )
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Graph API client is not started")
+        return self._client
+
+    async def request(
+        self,
+        operation: str,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        data: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None
+    ) -> httpx.Response:
+        """Send a request through the breaker and concurrency limit of its operation class.
+        
+        HTTP error responses are returned to the caller; GraphAPIError is
+        raised only when no response could be obtained.
+        """
+        breaker = self.breakers[operation]
+        limiter = self.limiters[operation]
+
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            raise GraphAPIError(str(e)) from e
+
+        try:
+            await limiter.acquire()
+        except BaseException:
+            # Cancelled while waiting for a slot: a half-open trial must not stay claimed
+            breaker.abort()
+            raise
+        overloaded = False
+        try:
+            response = await self.client.request(
+                method,
+                path,
+                params=params,
+                json=json,
+                data=data,
+                timeout=httpx.Timeout(timeout or self.timeouts[operation], connect=settings.GRAPH_CONNECT_TIMEOUT)
+            )
+            # Upstream overload signals shrink the concurrency limit
+            overloaded = response.status_code == 429 or response.status_code >= 500
+        except httpx.TimeoutException as e:
+            overloaded = True
+            self.timed_out[operation] += 1
+            breaker.record_failure()
+            raise GraphAPIError(f"Graph API {operation} call timed out") from e
+        except httpx.HTTPError as e:
+            breaker.record_failure()
+            raise GraphAPIError(f"Graph API {operation} call failed: {e}") from e
+        except BaseException:
+            # Cancelled or failed without an outcome from Facebook
+            breaker.abort()
+            raise
+        finally:
+            await limiter.release(overloaded=overloaded)
+
+        if overloaded:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        return response
+
+    async def get(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        operation: str = "profile"
+    ) -> httpx.Response:
+        return await self.request(operation, "GET", path, params=params)
+
+    async def post(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        operation: str = "send"
+    ) -> httpx.Response:
+        return await self.request(operation, "POST", path, params=params, json=json)
+
+    async def batch(
+        self,
+        access_token: str,
+        requests: List[Dict[str, Any]],
+        operation: str = "profile"
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Run up to MAX_BATCH_SIZE sub-requests in a single Graph batch call.
+        
+        Returns the decoded body of every sub-request in order, or None for
+        sub-requests that failed.
+        """
+        if len(requests) > self.MAX_BATCH_SIZE:
+            raise ValueError(f"Graph batch requests are limited to {self.MAX_BATCH_SIZE} sub-requests")
+
+        response = await self.request(
+            operation,
+            "POST",
+            "/",
+            params={"access_token": access_token},
+            data={"batch": json_codec.dumps(requests), "include_headers": "false"},
+            timeout=settings.GRAPH_BATCH_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise GraphAPIError(f"Graph batch call failed with status {response.status_code}")
+
+        results = []
+        for item in json_codec.loads(response.content):
+            if item and item.get("code") == 200:
+                results.append(json_codec.loads(item["body"]))
+            else:
+                results.append(None)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Breaker state and concurrency limit per operation class"""
+        return {
+            operation: {
+                "circuit": self.breakers[operation].stats(),
+                "concurrency": self.limiters[operation].stats(),
+                "timeouts": self.timed_out[operation],
+            }
+            for operation in self.OPERATIONS
+        }
+
+# Create a global instance
+graph_client = GraphClient(settings.GRAPH_API_URL)
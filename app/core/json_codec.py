@@ -0,0 +1,25 @@
+import importlib.util
+import json
+from typing import Any, Union
+
+# orjson is an optional, much faster drop-in; the standard library is used without it
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+
+if ORJSON_AVAILABLE:
+    import orjson
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Parse JSON, raising ValueError if it is malformed"""
+        return orjson.loads(data)
+
+    def dumps(value: Any) -> str:
+        """Serialize to compact JSON text"""
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+else:
+    def loads(data: Union[bytes, str]) -> Any:
+        """Parse JSON, raising ValueError if it is malformed"""
+        return json.loads(data)
+
+    def dumps(value: Any) -> str:
+        """Serialize to compact JSON text"""
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,39 @@
+import logging
+import random
+from typing import Any
+
+from app.core import json_codec
+
+def format_fields(fields: dict) -> str:
+    """``key=value`` pairs with JSON values, so strings are quoted and escaped"""
+    return " ".join(f"{key}={json_codec.dumps(value)}" for key, value in fields.items())
+
+class SampledLogger:
+    """Structured ``event key=value ...`` log lines for hot paths.
+
+    Warnings and errors are always logged. Lower levels, when enabled, are
+    only logged for a ``sample_rate`` fraction of calls so busy endpoints do
+    not flood the logs.
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rate: float):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.skipped = 0
+
+    def log(self, level: int, event: str, **fields: Any):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.skipped += 1
+            return
+        self.logger.log(level, "%s %s", event, format_fields(fields))
+
+    def debug(self, event: str, **fields: Any):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields: Any):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields: Any):
+        self.log(logging.WARNING, event, **fields)
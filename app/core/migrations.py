@@ -0,0 +1,34 @@
+from pathlib import Path
+from typing import Optional, Tuple
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+from app.core.database import engine
+
+# alembic.ini lives in the project root, next to the migrations directory
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+def get_alembic_config() -> Config:
+    return Config(str(ALEMBIC_INI))
+
+def get_schema_revisions() -> Tuple[Optional[str], Optional[str]]:
+    """Revision the database is at, and the latest revision in migrations/versions"""
+    script = ScriptDirectory.from_config(get_alembic_config())
+    with engine.connect() as connection:
+        current = MigrationContext.configure(connection).get_current_revision()
+    return current, script.get_current_head()
+
+def check_schema_version():
+    """Raise if the database schema is not at the latest migration.
+
+    The schema is owned by Alembic; the app never creates or alters tables
+    itself, so an out-of-date database is reported instead of patched.
+    """
+    current, head = get_schema_revisions()
+    if current != head:
+        raise RuntimeError(
+            f"Database schema is at revision {current or 'none'}, expected {head}. "
+            "Run `alembic upgrade head` before starting the application."
+        )
@@ -0,0 +1,29 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Opaque keyset cursor for a (timestamp, id) position"""
+    raw = f"{timestamp.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor made by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def encode_watermark(timestamp: datetime) -> str:
+    """Opaque delta sync watermark for a change time"""
+    return base64.urlsafe_b64encode(timestamp.isoformat().encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_watermark(watermark: str) -> datetime:
+    """Decode a watermark made by encode_watermark, raising ValueError if it is malformed"""
+    try:
+        padded = watermark + "=" * (-len(watermark) % 4)
+        return datetime.fromisoformat(base64.urlsafe_b64decode(padded).decode("utf-8"))
+    except Exception:
+        raise ValueError("Invalid watermark")
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+from sqlalchemy import text
+
+from app.core import json_codec
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Called with the channel and the JSON payload of every message received
+MessageHandler = Callable[[str, str], Awaitable[None]]
+# Called once the transport is back after an outage in which messages may have been lost
+ReconnectHandler = Callable[[], Awaitable[None]]
+
+class PubSub:
+    """Publish/subscribe transport for real-time events.
+
+    Publishers send a JSON payload to a channel; every process subscribed to
+    that channel gets it through its handler, including the publisher itself.
+    Channels registered with ``listen`` have a handler of their own, the
+    others go to the one given to ``start``.
+    """
+
+    def __init__(self):
+        self.channels: Set[str] = set()
+        self._handler: Optional[MessageHandler] = None
+        self._listeners: Dict[str, MessageHandler] = {}
+        self._reconnect_handlers: List[ReconnectHandler] = []
+
+        # Metrics
+        self.published = 0
+        self.received = 0
+
+    async def start(self, handler: MessageHandler, on_reconnect: Optional[ReconnectHandler] = None):
+        self._handler = handler
+        if on_reconnect is not None:
+            self._reconnect_handlers.append(on_reconnect)
+
+    async def stop(self):
+        self.channels.clear()
+        self._listeners.clear()
+        self._reconnect_handlers.clear()
+
+    async def listen(self, channel: str, handler: MessageHandler, on_reconnect: Optional[ReconnectHandler] = None):
+        """Subscribe to a channel whose messages go to ``handler`` instead of the default one"""
+        self._listeners[channel] = handler
+        if on_reconnect is not None:
+            self._reconnect_handlers.append(on_reconnect)
+        await self.subscribe(channel)
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+    async def publish(self, channel: str, payload: str):
+        raise NotImplementedError
+
+    async def _dispatch(self, channel: str, payload: str):
+        handler = self._listeners.get(channel, self._handler)
+        if handler is None or channel not in self.channels:
+            return
+        self.received += 1
+        try:
+            await handler(channel, payload)
+        except Exception:
+            logger.exception("Pub/sub handler failed on channel %s", channel)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self).__name__,
+            "channels": len(self.channels),
+            "published": self.published,
+            "received": self.received,
+        }
+
+class MemoryPubSub(PubSub):
+    """In-process delivery, for a single worker"""
+
+    async def publish(self, channel: str, payload: str):
+        self.published += 1
+        await self._dispatch(channel, payload)
+
+class PostgresPubSub(PubSub):
+    """Delivery between workers and nodes with Postgres LISTEN/NOTIFY.
+
+    Every worker keeps one dedicated listening connection and LISTENs only
+    to channels it has local subscribers for. Notifications are published on
+    a pooled connection of ``engine``. Payloads above the NOTIFY size limit
+    are split into parts sent in one transaction, which Postgres delivers
+    contiguously and in order, and reassembled by the receivers.
+    """
+
+    # NOTIFY payloads must stay under 8000 bytes; leave room for the envelope
+    MAX_PART_SIZE = 7000
+    # Split payloads whose parts were lost (e.g. across a reconnect) are dropped beyond this
+    MAX_PENDING_PARTS = 100
+
+    def __init__(self, dsn: str, engine):
+        super().__init__()
+        self.dsn = dsn
+        self.engine = engine
+        self._connection: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+        self._inbox: asyncio.Queue[Tuple[str, str]] = asyncio.Queue()
+        self._parts: Dict[str, List[Optional[str]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.reconnects = 0
+
+    async def start(self, handler: MessageHandler, on_reconnect: Optional[ReconnectHandler] = None):
+        await super().start(handler, on_reconnect)
+        await self._connect()
+        self._tasks = [
+            asyncio.create_task(self._dispatcher(), name="pubsub-dispatcher"),
+            asyncio.create_task(self._supervisor(), name="pubsub-supervisor"),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+        self._connection = None
+        await super().stop()
+
+    async def _connect(self):
+        """Open the listening connection and LISTEN to every current channel"""
+        async with self._lock:
+            self._connection = await asyncpg.connect(self.dsn)
+            for channel in self.channels:
+                await self._connection.add_listener(channel, self._on_notification)
+
+    async def _supervisor(self):
+        """Reconnect the listening connection when it drops"""
+        while True:
+            await asyncio.sleep(settings.PUBSUB_RECONNECT_INTERVAL)
+            if self._connection is not None and not self._connection.is_closed():
+                continue
+            try:
+                await self._connect()
+                self.reconnects += 1
+                logger.warning("Pub/sub listener reconnected, %d channels restored", len(self.channels))
+            except Exception as e:
+                logger.error("Pub/sub listener reconnect failed: %s", e)
+                continue
+            # Notifications sent while the listener was down are gone
+            for on_reconnect in self._reconnect_handlers:
+                try:
+                    await on_reconnect()
+                except Exception:
+                    logger.exception("Pub/sub reconnect handler failed")
+
+    async def subscribe(self, channel: str):
+        async with self._lock:
+            if channel in self.channels:
+                return
+            self.channels.add(channel)
+            if self._connection is not None and not self._connection.is_closed():
+                await self._connection.add_listener(channel, self._on_notification)
+
+    async def unsubscribe(self, channel: str):
+        async with self._lock:
+            if channel not in self.channels:
+                return
+            self.channels.discard(channel)
+            if self._connection is not None and not self._connection.is_closed():
+                await self._connection.remove_listener(channel, self._on_notification)
+
+    async def publish(self, channel: str, payload: str):
+        self.published += 1
+        if len(payload.encode("utf-8")) <= self.MAX_PART_SIZE:
+            notifications = [payload]
+        else:
+            message_id = uuid.uuid4().hex
+            chunks = [payload[i:i + self.MAX_PART_SIZE // 4] for i in range(0, len(payload), self.MAX_PART_SIZE // 4)]
+            # Chunks of 1/4 of the limit stay under it even if every character takes 4 bytes
+            notifications = [
+                json_codec.dumps({"_part": [message_id, index, len(chunks)], "data": chunk})
+                for index, chunk in enumerate(chunks)
+            ]
+
+        async with self.engine.begin() as connection:
+            for notification in notifications:
+                await connection.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": channel, "payload": notification}
+                )
+
+    def _on_notification(self, connection, pid, channel: str, payload: str):
+        # Called by asyncpg outside of any task; keep arrival order for the dispatcher
+        self._inbox.put_nowait((channel, payload))
+
+    async def _dispatcher(self):
+        while True:
+            channel, payload = await self._inbox.get()
+            if payload.startswith('{"_part"'):
+                payload = self._reassemble(payload)
+                if payload is None:
+                    continue
+            await self._dispatch(channel, payload)
+
+    def _reassemble(self, notification: str) -> Optional[str]:
+        """Collect the parts of a split payload; returns it once complete"""
+        envelope = json_codec.loads(notification)
+        message_id, index, count = envelope["_part"]
+        if message_id not in self._parts and len(self._parts) >= self.MAX_PENDING_PARTS:
+            self._parts.pop(next(iter(self._parts)))
+        parts = self._parts.setdefault(message_id, [None] * count)
+        parts[index] = envelope["data"]
+        if any(part is None for part in parts):
+            return None
+        del self._parts[message_id]
+        return "".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["reconnects"] = self.reconnects
+        stats["pending_parts"] = len(self._parts)
+        return stats
+
+def create_pubsub() -> PubSub:
+    if settings.PUBSUB_BACKEND == "postgres":
+        from app.core.database import async_engine
+        return PostgresPubSub(settings.DATABASE_URL, async_engine)
+    if settings.PUBSUB_BACKEND == "memory":
+        return MemoryPubSub()
+    raise ValueError(f"Unknown pub/sub backend: {settings.PUBSUB_BACKEND}")
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind the primary; 0 when it has replayed everything it received.
+# NULL when it is not streaming from the primary, since it then cannot tell how far behind it is
+# (reading the receiver status needs the pg_read_all_stats or pg_monitor role).
+# Followed by the WAL position the replica has replayed up to.
+LAG_QUERY = text(
+    "SELECT CASE "
+    "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END, "
+    "pg_last_wal_replay_lsn()::text"
+)
+
+# Primary WAL position once a write has committed, handed to the client as a cookie and a header
+WRITE_LSN_COOKIE = "write_lsn"
+WRITE_LSN_HEADER = "X-Write-LSN"
+
+def parse_lsn(value: Optional[str]) -> Optional[int]:
+    """Postgres LSN text (``16/B374D848``) as an integer, None if malformed"""
+    if not value:
+        return None
+    high, _, low = value.partition("/")
+    try:
+        return (int(high, 16) << 32) | int(low, 16)
+    except ValueError:
+        return None
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine: AsyncEngine = create_async_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=300
+        )
+        self.sessionmaker = async_sessionmaker(
+            self.engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+            info={"replica": name}
+        )
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.replay_lsn: Optional[int] = None
+        self.reads = 0
+
+class ReplicaRouter:
+    """Routes read-only sessions to streaming replicas.
+
+    A background task measures the replay lag of every replica; replicas
+    that are unreachable or more than ``REPLICA_MAX_LAG_SECONDS`` behind are
+    skipped, and reads fall back to the primary when none is usable.
+
+    After a write the client is handed the primary's WAL position, and its
+    reads go to the primary until the replica serving them has replayed up
+    to that position. The marker travels with the client, so it holds
+    whichever worker or node its next request reaches.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(f"replica-{index}", url) for index, url in enumerate(urls)]
+        self._by_name = {replica.name: replica for replica in self.replicas}
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+        self._monitor: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.primary_fallbacks = 0
+        self.read_your_writes = 0
+
+    async def start(self):
+        """Measure replica lag once, then keep measuring in the background"""
+        if not self.replicas:
+            return
+        await self.check_lag()
+        self._monitor = asyncio.create_task(self._monitor_lag(), name="replica-lag-monitor")
+        logger.info("Routing reads to %d replicas", len(self.replicas))
+
+    async def stop(self):
+        if self._monitor:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    async def check_lag(self):
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as connection:
+                    lag, replay_lsn = (await connection.execute(LAG_QUERY)).one()
+                replica.lag = float(lag) if lag is not None else None
+                replica.replay_lsn = parse_lsn(replay_lsn)
+                # A replica without a streaming WAL receiver is disconnected from the primary
+                healthy = replica.lag is not None and replica.lag <= settings.REPLICA_MAX_LAG_SECONDS
+            except Exception as e:
+                replica.lag = None
+                healthy = False
+                logger.debug("Replica %s lag check failed: %s", replica.name, e)
+            if healthy != replica.healthy:
+                logger.warning("Replica %s is now %s (lag %s)", replica.name, "in use" if healthy else "skipped", replica.lag)
+            replica.healthy = healthy
+
+    async def _monitor_lag(self):
+        while True:
+            await asyncio.sleep(settings.REPLICA_LAG_CHECK_INTERVAL)
+            await self.check_lag()
+
+    def pick(self) -> Optional[Replica]:
+        """Next usable replica in round-robin order, or None for the primary"""
+        for _ in range(len(self.replicas)):
+            replica = next(self._cycle)
+            if replica.healthy:
+                return replica
+        return None
+
+    def session(self) -> AsyncSession:
+        """Read-only session on a replica, or on the primary when none is usable"""
+        replica = self.pick()
+        if replica is None:
+            if self.replicas:
+                self.primary_fallbacks += 1
+            return AsyncSessionLocal()
+        replica.reads += 1
+        return replica.sessionmaker()
+
+    @staticmethod
+    def is_replica(db: AsyncSession) -> bool:
+        return "replica" in db.info
+
+    async def mark_write(self, response: Response, db: AsyncSession):
+        """Hand the client the primary's WAL position after a committed write.
+
+        Browsers send it back as a cookie; other clients echo the header.
+        """
+        if not self.replicas:
+            return
+        lsn = await db.scalar(text("SELECT pg_current_wal_lsn()::text"))
+        response.set_cookie(
+            WRITE_LSN_COOKIE,
+            lsn,
+            max_age=int(settings.READ_YOUR_WRITES_SECONDS),
+            httponly=True,
+            samesite="lax"
+        )
+        response.headers[WRITE_LSN_HEADER] = lsn
+
+    def behind_client(self, db: AsyncSession, request: Request) -> bool:
+        """Whether a replica session may not show the client's last write yet"""
+        if not self.is_replica(db):
+            return False
+        lsn = parse_lsn(request.headers.get(WRITE_LSN_HEADER) or request.cookies.get(WRITE_LSN_COOKIE))
+        if lsn is None:
+            return False
+        replay_lsn = self._by_name[db.info["replica"]].replay_lsn
+        return replay_lsn is None or replay_lsn < lsn
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "replicas": {
+                replica.name: {
+                    "healthy": replica.healthy,
+                    "lag": replica.lag,
+                    "reads": replica.reads,
+                }
+                for replica in self.replicas
+            },
+            "primary_fallbacks": self.primary_fallbacks,
+            "read_your_writes": self.read_your_writes,
+        }
+
+# Create a global instance
+replica_router = ReplicaRouter(settings.REPLICA_URLS)
+
+async def get_read_db():
+    """Session for read-only endpoints, served by a replica when one is usable"""
+    async with replica_router.session() as db:
+        yield db
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from typing import Any, Dict
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because its circuit breaker is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    ``closed``: calls go through. After ``failure_threshold`` consecutive
+    failures the breaker opens and refuses calls for ``reset_timeout`` seconds.
+    It then goes ``half_open`` and lets a single trial call through, which
+    closes it on success or opens it again on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+        # Metrics
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must fail fast"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit '{self.name}' is open")
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit '{self.name}' is half-open")
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+        self.state = "closed"
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def abort(self):
+        """Forget a call that ended without an outcome (e.g. cancelled)"""
+        self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit.
+
+    The limit grows by roughly one slot per ``limit`` successful calls and is
+    multiplied by ``backoff`` whenever the upstream signals overload
+    (429 or 5xx), never leaving ``[min_limit, max_limit]``.
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 100, backoff: float = 0.5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.in_flight = 0
+        self.backoffs = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, overloaded: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.backoffs += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "backoffs": self.backoffs,
+        }
+
+class TokenBucket:
+    """Token bucket rate limiter: ``rate`` tokens per second, bursts up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.waits = 0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self.waits += 1
+                await asyncio.sleep((1 - self.tokens) / self.rate)
@@ -1,10 +1,95 @@
+import asyncio
+import importlib.util
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Any, Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# argon2 needs the optional argon2-cffi package
+ARGON2_AVAILABLE = importlib.util.find_spec("argon2") is not None
+
+def _password_schemes():
+    """Schemes known to the context, the configured default first"""
+    if settings.PASSWORD_HASH_SCHEME == "argon2" and not ARGON2_AVAILABLE:
+        logger.warning("argon2-cffi is not installed, hashing passwords with bcrypt")
+    if settings.PASSWORD_HASH_SCHEME == "argon2" and ARGON2_AVAILABLE:
+        return ["argon2", "bcrypt"]
+    return ["bcrypt", "argon2"] if ARGON2_AVAILABLE else ["bcrypt"]
+
+# Hashes in any scheme but the default, or with outdated costs, are flagged for rehash
+pwd_context = CryptContext(
+    schemes=_password_schemes(),
+    deprecated="auto",
+    argon2__type="id",
+    argon2__time_cost=settings.ARGON2_TIME_COST,
+    argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.ARGON2_PARALLELISM,
+    bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
+
+class PasswordHasher:
+    """Runs password hashing on a bounded thread pool.
+
+    Hashing is deliberately slow and CPU bound; doing it on the event loop
+    stalls every other request of the worker. At most ``concurrency`` hashes
+    run at once, further calls wait for a free thread.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="password-hash")
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+
+        # Metrics
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            self.in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            finally:
+                self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        self.hashed += 1
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also returns a new hash when the stored one is outdated"""
+        self.verified += 1
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "scheme": pwd_context.default_scheme(),
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "hashed": self.hashed,
+            "verified": self.verified,
+            "rehashed": self.rehashed,
+        }
+
+# Create a global instance
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_CONCURRENCY)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -28,4 +113,4 @@ def verify_token(token: str) -> Optional[dict]:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         return payload
     except JWTError:
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+WebhookHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class WebhookQueueFull(Exception):
+    """Raised when a delivery is rejected because the queue is full"""
+
+class WebhookQueue:
+    """Bounded in-process queue drained by a pool of worker tasks.
+
+    The webhook endpoint only verifies and enqueues deliveries so it can
+    acknowledge Facebook immediately; the workers do the actual processing.
+    When the queue is full the overflow policy decides what happens:
+
+    - ``reject``: the delivery is refused and the endpoint answers 503, so
+      Facebook redelivers it later.
+    - ``drop_oldest``: the oldest queued delivery is discarded to make room.
+    - ``defer``: the delivery is refused but the endpoint still answers 200;
+      it stays pending in the webhook inbox until it is replayed.
+    """
+
+    OVERFLOW_POLICIES = ("reject", "drop_oldest", "defer")
+
+    def __init__(self, maxsize: int, workers: int, overflow_policy: str = "reject"):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown webhook overflow policy: {overflow_policy}")
+
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow_policy = overflow_policy
+
+        self._queue: Optional[asyncio.Queue[Tuple[float, Dict[str, Any]]]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._handler: Optional[WebhookHandler] = None
+
+        # Metrics
+        self.enqueued = 0
+        self.dequeued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.busy_workers = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self, handler: WebhookHandler):
+        """Create the queue and spawn the worker pool"""
+        self._handler = handler
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [
+            asyncio.create_task(self._worker(index), name=f"webhook-worker-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(
+            "Started %d webhook workers (queue size %d, overflow policy %s)",
+            self.workers, self.maxsize, self.overflow_policy
+        )
+
+    async def stop(self, timeout: float = 10.0):
+        """Give the workers a chance to drain the queue, then cancel them"""
+        if self._queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook queue not drained on shutdown, %d deliveries left", self.depth)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def enqueue(self, payload: Dict[str, Any]):
+        """Queue a verified webhook delivery without waiting for it to be processed"""
+        if self._queue is None:
+            raise RuntimeError("Webhook queue is not running")
+
+        item = (time.monotonic(), payload)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow_policy in ("reject", "defer"):
+                self.rejected += 1
+                raise WebhookQueueFull()
+
+            # drop_oldest: make room by discarding the head of the queue
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self.dropped += 1
+            self._queue.put_nowait(item)
+
+        self.enqueued += 1
+
+    async def _worker(self, index: int):
+        while True:
+            enqueued_at, payload = await self._queue.get()
+
+            lag = time.monotonic() - enqueued_at
+            self.dequeued += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._total_lag += lag
+
+            self.busy_workers += 1
+            try:
+                await self._handler(payload)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Webhook worker %d failed to process delivery", index)
+            finally:
+                self.busy_workers -= 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, throughput counters and lag"""
+        return {
+            "depth": self.depth,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "busy_workers": self.busy_workers,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "lag_seconds": {
+                "last": round(self.last_lag, 6),
+                "max": round(self.max_lag, 6),
+                "avg": round(self._total_lag / self.dequeued, 6) if self.dequeued else 0.0,
+            },
+        }
+
+# Create a global instance
+webhook_queue = WebhookQueue(
+    maxsize=settings.WEBHOOK_QUEUE_MAXSIZE,
+    workers=settings.WEBHOOK_WORKERS,
+    overflow_policy=settings.WEBHOOK_OVERFLOW_POLICY
+)
@@ -1,35 +1,491 @@
-from typing import Dict, Set
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+
+from app.core import json_codec
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.pubsub import PubSub, create_pubsub
+
+logger = logging.getLogger(__name__)
+
+class Connection:
+    """A client socket with its own bounded outgoing queue and writer task.
+
+    Broadcasts only enqueue the already serialized frame, so a slow client
+    never holds up delivery to the others. When the queue overflows the
+    client is a slow consumer: depending on ``WS_SLOW_CONSUMER_POLICY`` it is
+    disconnected, or the frame is dropped and the client is told how many
+    frames it missed once it catches up.
+    """
+
+    # A half-open socket would otherwise hold close() for the server's whole close handshake timeout
+    CLOSE_TIMEOUT = 2.0
+
+    def __init__(self, manager: "WebSocketManager", websocket: WebSocket, queue_size: int, user_id: int):
+        self.manager = manager
+        self.websocket = websocket
+        self.user_id = user_id
+        self.chats: Set[int] = set()
+        self.closed = False
+        self.released = False
+        self.dropped = 0
+        # Monotonic time of the last frame received from the client
+        self.last_seen = time.monotonic()
+        # Set once the client sends anything (a hello or a pong): only such clients are evicted when idle
+        self.heartbeats = False
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self._writer: Optional[asyncio.Task] = None
+        # Live frames set aside while missed ones are replayed
+        self._held: Optional[List[str]] = None
+
+    @property
+    def alive(self) -> bool:
+        return (
+            not self.closed
+            and self._writer is not None and not self._writer.done()
+            and self.websocket.client_state != WebSocketState.DISCONNECTED
+        )
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write())
+
+    def send(self, frame: str) -> bool:
+        """Queue a serialized frame; returns False if the client is not keeping up"""
+        if self.closed:
+            return True
+        if self._held is not None:
+            if len(self._held) >= self._queue.maxsize:
+                return False
+            self._held.append(frame)
+            return True
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def hold(self):
+        """Set live frames aside until ``resume``"""
+        self._held = []
+
+    async def resume(self, replayed: List[str]):
+        """Send the replayed frames, then the live frames held meanwhile.
+
+        Frames around the switch can be sent twice; clients skip those whose
+        seq they already applied.
+        """
+        for frame in replayed:
+            await self.websocket.send_text(frame)
+        while self._held:
+            await self.websocket.send_text(self._held.pop(0))
+        self._held = None
+
+    async def receive(self):
+        """Read client frames until the socket closes, answering client pings.
+
+        Any frame counts as activity and opts the client into idle
+        eviction; such clients are expected to answer the server's ``ping``
+        events with ``{"type": "pong"}``.
+        """
+        while True:
+            data = await self.websocket.receive_text()
+            self.last_seen = time.monotonic()
+            self.heartbeats = True
+            if '"ping"' in data:
+                try:
+                    ping = json_codec.loads(data).get("type") == "ping"
+                except (ValueError, AttributeError):
+                    ping = False
+                if ping:
+                    self.send(WebSocketManager.PONG_FRAME)
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                await self.websocket.send_text(frame)
+                if self.dropped and self._queue.empty():
+                    # Caught up after dropping frames: the client should reload its state
+                    await self.websocket.send_text(json_codec.dumps({"type": "frames_dropped", "count": self.dropped}))
+                    self.dropped = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; forget it instead of queueing more frames for it
+            await self.manager.disconnect(self)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), self.CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+class ReplayBuffer:
+    """Latest frames of one chat with the sequence numbers they cover.
+
+    Each frame announces the changes ``first`` to ``last``. The buffer holds
+    the frames of the chat received from sequence number ``start`` on, as
+    long as its user's channel stays subscribed (``epoch``). Frames can still
+    be lost upstream, so ``since`` only serves runs without holes.
+    """
+
+    def __init__(self, size: int, epoch: int, start: int):
+        self.size = size
+        self.epoch = epoch
+        self.start = start
+        self.frames: Deque[Tuple[int, int, str]] = deque()
+
+    def add(self, first: int, last: int, frame: str):
+        if self.frames and first < self.frames[-1][0]:
+            # Published out of order by another worker
+            bisect.insort(self.frames, (first, last, frame))
+        else:
+            self.frames.append((first, last, frame))
+        if len(self.frames) > self.size:
+            _, oldest, _ = self.frames.popleft()
+            self.start = max(self.start, oldest + 1)
+
+    def since(self, seq: int, until: int) -> Optional[List[str]]:
+        """Frames of changes after ``seq``, or None unless they cover every change up to ``until``"""
+        if seq + 1 < self.start:
+            return None
+        expected = seq + 1
+        frames = []
+        for first, last, frame in self.frames:
+            if last < expected:
+                continue
+            if first > expected:
+                # A frame in between never arrived
+                return None
+            frames.append(frame)
+            expected = last + 1
+        if expected <= until:
+            return None
+        return frames
 
 class WebSocketManager:
-    def __init__(self):
+    """Fans chat events out to WebSocket clients across workers.
+
+    Events are published on the pub/sub channel of the user owning the chat,
+    serialized once. Each worker subscribes only to the users it has sockets
+    for and queues what it receives on the matching sockets: the user's own
+    sockets, which follow all of their chats, and the sockets opened on the
+    event's chat.
+
+    Every ``heartbeat_interval`` a sweep pings all sockets and evicts dead
+    ones. Clients that ever sent a frame (a hello or a pong) are expected to
+    answer pings and are evicted after ``idle_timeout`` seconds of silence,
+    such as half-open connections of laptops that went to sleep; listen-only
+    clients are left to the server's protocol pings and to write failures,
+    which close the socket once the peer is gone. Connections are
+    capped per worker and per user; a user over the cap loses their oldest
+    socket, which is the most likely to be dead.
+
+    Chat events carry the sequence number of the change they announce. The
+    latest frames of each chat are kept in a replay buffer so reconnecting
+    clients only get what they missed. When the pub/sub listener reconnects,
+    events published meanwhile are lost: the buffers are dropped and every
+    socket is told to resync.
+    """
+
+    SLOW_CONSUMER_POLICIES = ("disconnect", "drop")
+    PING_FRAME = json_codec.dumps({"type": "ping"})
+    PONG_FRAME = json_codec.dumps({"type": "pong"})
+    RESYNC_FRAME = json_codec.dumps({"type": "resync_required"})
+
+    def __init__(
+        self,
+        pubsub: PubSub,
+        queue_size: int,
+        slow_consumer_policy: str = "disconnect",
+        heartbeat_interval: float = 25.0,
+        idle_timeout: float = 75.0,
+        max_connections: int = 10000,
+        max_connections_per_user: int = 20,
+        replay_buffer_size: int = 100,
+        replay_chats: int = 10000
+    ):
+        if slow_consumer_policy not in self.SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+
+        self.pubsub = pubsub
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
         # Store connections by chat_id
-        self.active_connections: Dict[int, Set[WebSocket]] = {}
+        self.active_connections: Dict[int, Set[Connection]] = {}
+        # Sockets following every chat of a user, by user id
+        self.user_connections: Dict[int, Set[Connection]] = {}
+        # Every local connection of each user, oldest first; a user's channel is subscribed while it has any
+        self._user_sockets: Dict[int, List[Connection]] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        # Replay buffers by chat id; a buffer is only valid for the subscription of its user's channel it was filled under
+        self.replay_buffer_size = replay_buffer_size
+        self.replay_buffers: LRUCache[ReplayBuffer] = LRUCache(replay_chats)
+        self._epochs: Dict[int, int] = {}
+        self._next_epoch = 0
+
+        # Metrics
+        self.live = 0
+        self.frames_queued = 0
+        self.frames_dropped = 0
+        self.slow_consumers = 0
+        self.rejected = 0
+        self.evicted_idle = 0
+        self.evicted_dead = 0
+        self.evicted_over_limit = 0
+        self.sweeps = 0
+        self.replayed = 0
+        self.replay_misses = 0
+        self.resyncs = 0
+
+    @staticmethod
+    def channel(user_id: int) -> str:
+        return f"user_{user_id}"
+
+    async def start(self):
+        await self.pubsub.start(self._on_message, self._on_reconnect)
+        self._sweeper = asyncio.create_task(self._sweep_loop(), name="websocket-sweeper")
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        await self.pubsub.stop()
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        chat_id: Optional[int] = None,
+        hold: bool = False
+    ) -> Optional[Connection]:
+        """Accept a socket for one chat of ``user_id``, or for all of them if no chat is given.
+
+        With ``hold`` live frames are set aside until ``Connection.resume``.
+        Returns None, with the socket refused, when the worker is at its connection limit.
+        """
+        if self.live >= self.max_connections:
+            self.rejected += 1
+            # 1013: try again later
+            await websocket.close(code=1013, reason="Too many connections")
+            return None
+
+        sockets = self._user_sockets.get(user_id, ())
+        if len(sockets) >= self.max_connections_per_user:
+            self.evicted_over_limit += 1
+            await self.disconnect(sockets[0], 4029, "Too many connections for this user")
 
-    async def connect(self, websocket: WebSocket, chat_id: int):
         await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = set()
-        self.active_connections[chat_id].add(websocket)
-
-    def disconnect(self, websocket: WebSocket, chat_id: int):
-        if chat_id in self.active_connections:
-            self.active_connections[chat_id].discard(websocket)
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-
-    async def broadcast_to_chat(self, chat_id: int, message: dict):
-        if chat_id in self.active_connections:
-            disconnected_ws = set()
-            for websocket in self.active_connections[chat_id]:
-                try:
-                    await websocket.send_json(message)
-                except:
-                    disconnected_ws.add(websocket)
-            
-            # Clean up disconnected websockets
-            for ws in disconnected_ws:
-                self.disconnect(ws, chat_id)
+        connection = Connection(self, websocket, self.queue_size, user_id)
+        if hold:
+            connection.hold()
+        connection.start()
+
+        if chat_id is None:
+            self.user_connections.setdefault(user_id, set()).add(connection)
+        else:
+            connection.chats.add(chat_id)
+            self.active_connections.setdefault(chat_id, set()).add(connection)
+
+        self.live += 1
+        self._user_sockets.setdefault(user_id, []).append(connection)
+        if len(self._user_sockets[user_id]) == 1:
+            self._next_epoch += 1
+            self._epochs[user_id] = self._next_epoch
+            await self.pubsub.subscribe(self.channel(user_id))
+        return connection
+
+    async def disconnect(self, connection: Connection, code: int = 1000, reason: str = ""):
+        """Forget a connection and close its socket"""
+        if not connection.released:
+            connection.released = True
+            await self._release(connection)
+        await connection.close(code=code, reason=reason)
+
+    async def _release(self, connection: Connection):
+        for chat_id in connection.chats:
+            if chat_id in self.active_connections:
+                self.active_connections[chat_id].discard(connection)
+                if not self.active_connections[chat_id]:
+                    del self.active_connections[chat_id]
+        user_id = connection.user_id
+        if user_id in self.user_connections:
+            self.user_connections[user_id].discard(connection)
+            if not self.user_connections[user_id]:
+                del self.user_connections[user_id]
+
+        self.live -= 1
+        self._user_sockets[user_id].remove(connection)
+        if not self._user_sockets[user_id]:
+            del self._user_sockets[user_id]
+            # Events of the user's chats stop reaching this worker: their buffers go stale
+            del self._epochs[user_id]
+            await self.pubsub.unsubscribe(self.channel(user_id))
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("WebSocket sweep failed")
+
+    async def sweep(self):
+        """Evict dead and idle sockets and ping the others"""
+        self.sweeps += 1
+        idle_before = time.monotonic() - self.idle_timeout
+        evictions = []
+        for sockets in list(self._user_sockets.values()):
+            for connection in list(sockets):
+                if not connection.alive:
+                    # The client left without the receive loop noticing
+                    self.evicted_dead += 1
+                    evictions.append(self.disconnect(connection))
+                elif connection.heartbeats and connection.last_seen < idle_before:
+                    self.evicted_idle += 1
+                    # 4008: timeout, like HTTP 408
+                    evictions.append(self.disconnect(connection, 4008, "Idle timeout"))
+                else:
+                    connection.send(self.PING_FRAME)
+        if evictions:
+            await asyncio.gather(*evictions, return_exceptions=True)
+            logger.info("Evicted %d dead or idle WebSockets", len(evictions))
+
+    async def broadcast_to_chat(
+        self,
+        chat_id: int,
+        user_id: int,
+        message: dict,
+        seq: int,
+        first_seq: Optional[int] = None
+    ):
+        """Send an event of a chat owned by ``user_id`` to its sockets, on any worker.
+
+        ``seq`` is the highest sequence number of the changes in the event,
+        ``first_seq`` the lowest when it announces several.
+        """
+        frame = json_codec.dumps({"chat_id": chat_id, "seq": seq, **message})
+        # Routing prefix, stripped before the frame is sent to clients
+        await self.pubsub.publish(self.channel(user_id), f"{chat_id}:{first_seq or seq}:{seq} {frame}")
+
+    async def broadcast_to_user(self, user_id: int, message: dict):
+        """Send an event to the sockets following all of a user's chats, on any worker"""
+        await self.pubsub.publish(self.channel(user_id), f"- {json_codec.dumps(message)}")
+
+    async def _on_message(self, channel: str, payload: str):
+        user_id = int(channel[len("user_"):])
+        target, frame = payload.split(" ", 1)
+
+        recipients = list(self.user_connections.get(user_id, ()))
+        if target != "-":
+            chat_id, *seqs = map(int, target.split(":"))
+            self._buffer(chat_id, user_id, seqs[0], seqs[-1], frame)
+            recipients.extend(self.active_connections.get(chat_id, ()))
+
+        slow = []
+        for connection in recipients:
+            if connection.send(frame):
+                self.frames_queued += 1
+                continue
+            self.frames_dropped += 1
+            if self.slow_consumer_policy == "drop":
+                connection.dropped += 1
+            else:
+                slow.append(connection)
+
+        for connection in slow:
+            self.slow_consumers += 1
+            logger.warning("Closing slow WebSocket consumer of user %d", user_id)
+            # 1013: try again later
+            await self.disconnect(connection, 1013, "Client too slow")
+
+    async def _on_reconnect(self):
+        """Drop the replay buffers and have every socket resync after a pub/sub outage"""
+        self.replay_buffers.clear()
+        self.resyncs += 1
+        for user_id, sockets in list(self._user_sockets.items()):
+            for connection in sockets:
+                if connection.chats:
+                    for chat_id in connection.chats:
+                        connection.send(json_codec.dumps({"chat_id": chat_id, "type": "resync_required"}))
+                else:
+                    connection.send(self.RESYNC_FRAME)
+
+    def _buffer(self, chat_id: int, user_id: int, first: int, last: int, frame: str):
+        epoch = self._epochs.get(user_id)
+        if epoch is None:
+            return
+        buffer = self.replay_buffers.get(chat_id)
+        if buffer is None or buffer.epoch != epoch:
+            buffer = ReplayBuffer(self.replay_buffer_size, epoch, first)
+            self.replay_buffers.set(chat_id, buffer)
+        buffer.add(first, last, frame)
+
+    def replay(self, chat_id: int, user_id: int, seq: int, until: int) -> Optional[List[str]]:
+        """Buffered frames of a chat's changes after ``seq``.
+
+        Returns None if the buffer does not hold every change up to ``until``,
+        the chat's last_seq read before the socket subscribed.
+        """
+        buffer = self.replay_buffers.get(chat_id)
+        frames = None
+        if buffer is not None and buffer.epoch == self._epochs.get(user_id):
+            frames = buffer.since(seq, until)
+        if frames is None:
+            self.replay_misses += 1
+        else:
+            self.replayed += 1
+        return frames
+
+    def stats(self) -> Dict[str, Any]:
+        chat_connections = {connection for chat in self.active_connections.values() for connection in chat}
+        user_connections = sum(len(connections) for connections in self.user_connections.values())
+        return {
+            "live": self.live,
+            "connections": len(chat_connections) + user_connections,
+            "chat_connections": len(chat_connections),
+            "user_connections": user_connections,
+            "chats": len(self.active_connections),
+            "users": len(self._user_sockets),
+            "frames_queued": self.frames_queued,
+            "frames_dropped": self.frames_dropped,
+            "slow_consumers": self.slow_consumers,
+            "rejected": self.rejected,
+            "evicted_idle": self.evicted_idle,
+            "evicted_dead": self.evicted_dead,
+            "evicted_over_limit": self.evicted_over_limit,
+            "sweeps": self.sweeps,
+            "replayed": self.replayed,
+            "replay_misses": self.replay_misses,
+            "replay_buffers": len(self.replay_buffers),
+            "resyncs": self.resyncs,
+        }
 
 # Create a global instance
-manager = WebSocketManager() 
\ No newline at end of file
+manager = WebSocketManager(
+    create_pubsub(),
+    settings.WS_SEND_QUEUE_SIZE,
+    settings.WS_SLOW_CONSUMER_POLICY,
+    heartbeat_interval=settings.WS_HEARTBEAT_INTERVAL,
+    idle_timeout=settings.WS_IDLE_TIMEOUT,
+    max_connections=settings.WS_MAX_CONNECTIONS,
+    max_connections_per_user=settings.WS_MAX_CONNECTIONS_PER_USER,
+    replay_buffer_size=settings.WS_REPLAY_BUFFER_SIZE,
+    replay_chats=settings.WS_REPLAY_CHATS
+)
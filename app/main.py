@@ -1,14 +1,27 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from contextlib import asynccontextmanager
 from app.core.config import settings
-from app.core.database import engine, Base, test_db_connection
+from app.core.database import async_engine, test_db_connection
+from app.core.graph_client import graph_client
+from app.core.json_codec import ORJSON_AVAILABLE
+from app.core.migrations import check_schema_version
+from app.core.replicas import replica_router
+from app.core.security import password_hasher
+from app.core.webhook_queue import webhook_queue
+from app.core.websocket import manager
+from app.services.messenger_service import recent_mids
+from app.services.profile_service import profile_cache, profile_refresher
+from app.services.send_pipeline import send_pipeline
+from app.services.webhook_inbox_service import webhook_sweeper
+from app.services.user_service import principal_cache
 from app.api.routes import auth
 from app.api import facebook, messenger
 import logging
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=settings.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
@@ -23,21 +36,48 @@ async def lifespan(app: FastAPI):
     
     logger.info("Database connection successful")
     
-    # Create database tables
+    # Tables are managed by Alembic migrations, only check they are up to date
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully")
+        check_schema_version()
+        logger.info("Database schema is up to date")
     except Exception as e:
-        logger.error(f"Failed to create database tables: {e}")
+        logger.error(f"Database schema check failed: {e}")
         raise
     
+    # Start measuring replica lag before reads are routed to them
+    await replica_router.start()
+    
+    # Open the shared Graph API connection pool
+    await graph_client.start()
+    
+    # Subscribe to real-time events published by every worker
+    await manager.start()
+    await principal_cache.start(manager.pubsub)
+    
+    # Start the webhook worker pool, the inbox sweeper and the outgoing message pipeline
+    await webhook_queue.start(messenger.process_webhook)
+    await webhook_sweeper.start()
+    await send_pipeline.start()
+    
     yield
     
     # Shutdown
     logger.info("Shutting down Facebook Helpdesk API...")
+    await webhook_sweeper.stop()
+    await webhook_queue.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT)
+    await send_pipeline.stop(timeout=settings.SEND_SHUTDOWN_TIMEOUT)
+    await profile_refresher.stop()
+    await principal_cache.stop()
+    await manager.stop()
+    await graph_client.close()
+    await replica_router.stop()
+    await async_engine.dispose()
+    password_hasher.shutdown()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    # Responses are serialized with orjson when it is installed
+    default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse,
     version=settings.VERSION,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     lifespan=lifespan
@@ -50,6 +90,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Conditional GETs and delta sync
+    expose_headers=["ETag", "X-Sync-Token"],
 )
 
 # Include routers
@@ -77,4 +119,23 @@ def health_check():
         "status": "healthy",
         "database": db_status,
         "version": settings.VERSION
-    }
\ No newline at end of file
+    }
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "webhook_queue": webhook_queue.stats(),
+        "webhook_dedup": recent_mids.stats(),
+        "webhook_sweeper": webhook_sweeper.stats(),
+        "graph_api": graph_client.stats(),
+        "send_pipeline": send_pipeline.stats(),
+        "websockets": manager.stats(),
+        "pubsub": manager.pubsub.stats(),
+        "database": replica_router.stats(),
+        "principals": principal_cache.stats(),
+        "passwords": password_hasher.stats(),
+        "profiles": {
+            "cache": profile_cache.stats(),
+            "refresh": profile_refresher.stats()
+        }
+    }
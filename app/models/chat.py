@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import pytz
@@ -15,10 +15,24 @@ class Chat(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Latest message, maintained at write time for the inbox
+    last_message_preview = Column(String(255))
+    last_message_at = Column(DateTime)
+    last_message_type = Column(String(50))  # 'incoming' or 'outgoing'
+    # Last sequence number given to a change in this chat
+    last_seq = Column(Integer, default=0, nullable=False)
+
     # Relationships
     messages = relationship("Message", back_populates="chat")
     user = relationship("User", back_populates="chats")
 
+    __table_args__ = (
+        # Chat lookup by customer in get_or_create_chat
+        Index("ix_chats_user_id_fb_user_id_created_at", "user_id", "fb_user_id", "created_at"),
+        # Inbox listing by most recent activity
+        Index("ix_chats_user_id_last_message_at_id", "user_id", "last_message_at", "id"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -26,8 +40,30 @@ class Message(Base):
     chat_id = Column(Integer, ForeignKey("chats.id"))
     content = Column(Text)
     message_type = Column(String(50))  # 'incoming' or 'outgoing'
-    fb_message_id = Column(String(255))  # Facebook message ID
-    timestamp = Column(DateTime, default=lambda: datetime.now(pytz.timezone('Asia/Kolkata')))
+    fb_message_id = Column(String(255), index=True)  # Facebook message ID
+    status = Column(String(20), default="received", nullable=False)  # 'received' for incoming; 'pending', 'sent' or 'failed' for outgoing
+    error = Column(Text)  # Last delivery error of a failed outgoing message
+    timestamp = Column(DateTime, default=lambda: datetime.now(pytz.timezone('Asia/Kolkata')).replace(tzinfo=None))  # IST wall-clock time
+    seq = Column(Integer, nullable=False)  # Per-chat sequence number of the message's latest change (creation or status)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Time of that change, for delta sync
+    claimed_at = Column(DateTime)  # Start of the send worker's lease on a pending outgoing message
 
     # Relationships
-    chat = relationship("Chat", back_populates="messages") 
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages")
+
+    __table_args__ = (
+        # Keyset pagination of a chat's history
+        Index("ix_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+        # Changes since a sequence number, replayed to reconnecting sockets
+        Index("ix_messages_chat_id_seq", "chat_id", "seq", unique=True),
+        # Webhook redeliveries store each incoming message once
+        Index(
+            "ix_messages_chat_id_fb_message_id", "chat_id", "fb_message_id",
+            unique=True, postgresql_where=text("message_type = 'incoming'")
+        ),
+        # Pending outgoing messages whose send lease expired, re-queued by recover
+        Index(
+            "ix_messages_pending_outgoing_claimed_at", "claimed_at",
+            postgresql_where=text("message_type = 'outgoing' AND status = 'pending'")
+        ),
+    ) 
\ No newline at end of file
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, UniqueConstraint
+from datetime import datetime
+
+from app.core.database import Base
+
+class CustomerProfile(Base):
+    """Messenger customer profile, keyed by page and page-scoped id (PSID)"""
+    __tablename__ = "customer_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    page_id = Column(String, ForeignKey("facebook_pages.id"), nullable=False)
+    psid = Column(String(255), nullable=False)  # Page-scoped Facebook user ID
+    name = Column(String(255))
+    profile_pic = Column(Text)
+    fetched_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("page_id", "psid", name="uq_customer_profiles_page_psid"),
+    )
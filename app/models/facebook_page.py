@@ -6,7 +6,7 @@ class FacebookPage(Base):
     __tablename__ = "facebook_pages"
 
     id = Column(String, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     access_token = Column(String, nullable=False)
     picture_url = Column(String)
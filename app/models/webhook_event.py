@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from datetime import datetime
+
+from app.core.database import Base
+
+class WebhookEvent(Base):
+    """Raw Messenger webhook delivery, stored before it is processed"""
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    payload = Column(Text, nullable=False)  # Raw request body as received
+    status = Column(String(20), default="pending", nullable=False)  # 'pending', 'processed' or 'failed'
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime)
+
+    __table_args__ = (
+        # Keeps the replay scan small once most events are processed
+        Index(
+            "ix_webhook_events_unprocessed",
+            "id",
+            postgresql_where=(status != "processed")
+        ),
+    )
@@ -14,10 +14,20 @@ class MessageCreate(MessageBase):
 class MessageResponse(MessageBase):
     id: int
     chat_id: int
+    status: str
+    error: Optional[str] = None
+    seq: int  # Per-chat sequence number of the message's latest change
 
     class Config:
         from_attributes = True
 
+class MessagePage(BaseModel):
+    messages: List[MessageResponse]  # Oldest first
+    before_cursor: Optional[str] = None  # Pass as `before` to load older messages
+    after_cursor: Optional[str] = None  # Pass as `after` to load newer messages
+    has_more: bool  # More messages exist in the requested direction
+    last_seq: int  # Pass as `since` to get only later changes: the chat's latest change, or the last one returned when a `since` page has_more
+
 class ChatBase(BaseModel):
     fb_user_id: str
     fb_user_name: str
@@ -30,10 +40,34 @@ class ChatResponse(ChatBase):
     user_id: int
     created_at: datetime
     updated_at: datetime
+    last_seq: int
     messages: List[MessageResponse] = []
 
     class Config:
         from_attributes = True
 
+class InboxItem(BaseModel):
+    id: int
+    fb_user_id: str
+    fb_user_name: str
+    last_message_preview: Optional[str] = None
+    last_message_at: datetime
+    last_message_type: Optional[str] = None  # 'incoming' or 'outgoing'
+
+    class Config:
+        from_attributes = True
+
+class InboxPage(BaseModel):
+    chats: List[InboxItem]  # Most recent activity first
+    next_cursor: Optional[str] = None  # Pass as `cursor` to load the next page
+
 class SendMessageRequest(BaseModel):
-    content: str 
\ No newline at end of file
+    content: str 
+
+class BulkSendFilter(BaseModel):
+    active_within_hours: int = 24  # Chats with a message in the last N hours
+
+class BulkSendRequest(BaseModel):
+    content: str
+    chat_ids: Optional[List[int]] = None
+    filter: Optional[BulkSendFilter] = None
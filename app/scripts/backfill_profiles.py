@@ -0,0 +1,279 @@
+"""Backfill or refresh customer profiles with Graph API batch requests.
+
+Usage:
+    python -m app.scripts.backfill_profiles [--refresh] [--concurrency 4] [--resume]
+
+By default only chats still named "Unknown User" are backfilled. With
+--refresh every stored customer profile older than PROFILE_TTL_HOURS is
+fetched again (--all refreshes every profile regardless of age).
+
+Up to 50 lookups are packed into each Graph batch call and several batches
+run concurrently. Results are written with one bulk upsert into
+customer_profiles and one bulk update of chat names per chunk. Progress is
+checkpointed after every chunk so an interrupted run can be resumed.
+Lookups of failed batches are kept in the checkpoint and retried once the
+scan is done; those still failing are retried by the next --resume.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import json_codec
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, async_engine
+from app.core.graph_client import graph_client, GraphAPIError
+from app.models.chat import Chat
+from app.models.customer_profile import CustomerProfile
+from app.models.facebook_page import FacebookPage
+from app.models import user  # noqa: F401  (mapper of the Chat and FacebookPage relationships)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UNKNOWN_USER = "Unknown User"
+
+class Target(NamedTuple):
+    page_id: str
+    access_token: str
+    user_id: int
+    psid: str
+
+class Checkpoint(NamedTuple):
+    """Last scanned id, and the (page_id, psid) lookups of failed batches"""
+    last_id: int
+    failed: List[Tuple[str, str]]
+
+async def load_pages(db: AsyncSession) -> Tuple[Dict[str, FacebookPage], Dict[int, FacebookPage]]:
+    """Pages by id, and the page used for each user's chats (their first page)"""
+    pages_by_id: Dict[str, FacebookPage] = {}
+    pages_by_user: Dict[int, FacebookPage] = {}
+    for page in await db.scalars(select(FacebookPage).order_by(FacebookPage.user_id)):
+        pages_by_id[page.id] = page
+        pages_by_user.setdefault(page.user_id, page)
+    return pages_by_id, pages_by_user
+
+async def scan_unknown_chats(db: AsyncSession, pages_by_user, after_id: int, chunk_size: int) -> Tuple[List[Target], Optional[int]]:
+    """Next chunk of chats without a customer name, by chat id"""
+    rows = (await db.execute(
+        select(Chat.id, Chat.user_id, Chat.fb_user_id)
+        .where(Chat.id > after_id, Chat.fb_user_name == UNKNOWN_USER)
+        .order_by(Chat.id)
+        .limit(chunk_size)
+    )).all()
+    if not rows:
+        return [], None
+
+    targets = {}
+    for row in rows:
+        page = pages_by_user.get(row.user_id)
+        if page and row.fb_user_id:
+            targets[(page.id, row.fb_user_id)] = Target(page.id, page.access_token, row.user_id, row.fb_user_id)
+    return list(targets.values()), rows[-1].id
+
+async def scan_profiles(db: AsyncSession, pages_by_id, after_id: int, chunk_size: int, stale_before: Optional[datetime]) -> Tuple[List[Target], Optional[int]]:
+    """Next chunk of stored profiles to refresh, by profile id"""
+    query = select(CustomerProfile.id, CustomerProfile.page_id, CustomerProfile.psid).where(CustomerProfile.id > after_id)
+    if stale_before is not None:
+        query = query.where(CustomerProfile.fetched_at < stale_before)
+    rows = (await db.execute(query.order_by(CustomerProfile.id).limit(chunk_size))).all()
+    if not rows:
+        return [], None
+
+    targets = []
+    for row in rows:
+        page = pages_by_id.get(row.page_id)
+        if page:
+            targets.append(Target(page.id, page.access_token, page.user_id, row.psid))
+    return targets, rows[-1].id
+
+async def fetch_batch(targets: List[Target], semaphore: asyncio.Semaphore) -> Optional[List[Tuple[Target, dict]]]:
+    """Look up one page's worth of customers in a single Graph batch call; None if the call failed"""
+    requests = [
+        {"method": "GET", "relative_url": f"{target.psid}?fields=name,profile_pic"}
+        for target in targets
+    ]
+    async with semaphore:
+        try:
+            results = await graph_client.batch(targets[0].access_token, requests)
+        except GraphAPIError as e:
+            logger.warning("Batch of %d lookups failed: %s", len(targets), e)
+            return None
+    return [(target, result) for target, result in zip(targets, results) if result]
+
+async def write_results(db: AsyncSession, results: List[Tuple[Target, dict]], only_unknown: bool):
+    """Bulk upsert the fetched profiles and bulk update the chat names"""
+    if not results:
+        return
+
+    fetched_at = datetime.utcnow()
+    statement = insert(CustomerProfile).values([
+        {
+            "page_id": target.page_id,
+            "psid": target.psid,
+            "name": info.get("name"),
+            "profile_pic": info.get("profile_pic"),
+            "fetched_at": fetched_at
+        }
+        for target, info in results
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[CustomerProfile.page_id, CustomerProfile.psid],
+        set_={
+            "name": statement.excluded.name,
+            "profile_pic": statement.excluded.profile_pic,
+            "fetched_at": statement.excluded.fetched_at
+        }
+    ))
+
+    chat_update = (
+        update(Chat.__table__)
+        .where(
+            Chat.user_id == bindparam("b_user_id"),
+            Chat.fb_user_id == bindparam("b_psid")
+        )
+        .values(fb_user_name=bindparam("b_name"))
+    )
+    if only_unknown:
+        chat_update = chat_update.where(Chat.fb_user_name == UNKNOWN_USER)
+    chat_names = [
+        {"b_user_id": target.user_id, "b_psid": target.psid, "b_name": info["name"]}
+        for target, info in results
+        if info.get("name")
+    ]
+    if chat_names:
+        await db.execute(chat_update, chat_names)
+    await db.commit()
+
+async def process(targets: List[Target], semaphore: asyncio.Semaphore, only_unknown: bool) -> Tuple[int, List[Target]]:
+    """Look up and store a chunk of targets; returns the profiles updated and the targets of failed batches"""
+    # Batches must share a page access token
+    by_page: Dict[str, List[Target]] = {}
+    for target in targets:
+        by_page.setdefault(target.page_id, []).append(target)
+    batches = [
+        page_targets[i:i + graph_client.MAX_BATCH_SIZE]
+        for page_targets in by_page.values()
+        for i in range(0, len(page_targets), graph_client.MAX_BATCH_SIZE)
+    ]
+
+    batch_results = await asyncio.gather(*(fetch_batch(batch, semaphore) for batch in batches))
+    results = [item for batch_result in batch_results if batch_result for item in batch_result]
+    failed = [target for batch, batch_result in zip(batches, batch_results) if batch_result is None for target in batch]
+
+    async with AsyncSessionLocal() as db:
+        await write_results(db, results, only_unknown)
+    return len(results), failed
+
+def read_checkpoint(path: str) -> Checkpoint:
+    if not os.path.exists(path):
+        return Checkpoint(0, [])
+    with open(path) as f:
+        data = json_codec.loads(f.read().strip() or "0")
+    # Checkpoints of earlier versions only hold the last id
+    if isinstance(data, int):
+        return Checkpoint(data, [])
+    return Checkpoint(data["last_id"], [tuple(lookup) for lookup in data["failed"]])
+
+def write_checkpoint(path: str, last_id: int, failed: List[Target]):
+    with open(path, "w") as f:
+        f.write(json_codec.dumps({
+            "last_id": last_id,
+            "failed": [[target.page_id, target.psid] for target in failed]
+        }))
+
+async def backfill(refresh: bool, refresh_all: bool, chunk_size: int, concurrency: int, checkpoint: str, resume: bool):
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    state = read_checkpoint(checkpoint) if resume else Checkpoint(0, [])
+    last_id = state.last_id
+    stale_before = None if refresh_all else datetime.utcnow() - timedelta(hours=settings.PROFILE_TTL_HOURS)
+    looked_up = 0
+    updated = 0
+
+    async with AsyncSessionLocal() as db:
+        pages_by_id, pages_by_user = await load_pages(db)
+
+    # Lookups of batches that failed in an earlier run are retried with the scan's failures
+    failed = [
+        Target(page_id, pages_by_id[page_id].access_token, pages_by_id[page_id].user_id, psid)
+        for page_id, psid in state.failed
+        if page_id in pages_by_id
+    ]
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            if refresh:
+                targets, next_id = await scan_profiles(db, pages_by_id, last_id, chunk_size, stale_before)
+            else:
+                targets, next_id = await scan_unknown_chats(db, pages_by_user, last_id, chunk_size)
+        if next_id is None:
+            break
+
+        chunk_updated, chunk_failed = await process(targets, semaphore, only_unknown=not refresh)
+        failed.extend(chunk_failed)
+
+        last_id = next_id
+        write_checkpoint(checkpoint, last_id, failed)
+        looked_up += len(targets)
+        updated += chunk_updated
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            "Looked up %d customers, updated %d (%.1f lookups/s), checkpoint %d, %d failed lookups to retry",
+            looked_up, updated, looked_up / elapsed if elapsed else 0.0, last_id, len(failed)
+        )
+
+    if failed:
+        logger.info("Retrying %d lookups of failed batches", len(failed))
+        retried, failed = await process(failed, semaphore, only_unknown=not refresh)
+        updated += retried
+        write_checkpoint(checkpoint, last_id, failed)
+        if failed:
+            logger.warning("%d lookups still failing, run again with --resume to retry them", len(failed))
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        "Profile backfill finished: %d lookups, %d updated in %.1fs (%.1f lookups/s)",
+        looked_up, updated, elapsed, looked_up / elapsed if elapsed else 0.0
+    )
+
+async def run(args):
+    await graph_client.start()
+    try:
+        await backfill(
+            refresh=args.refresh or args.all,
+            refresh_all=args.all,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+            checkpoint=args.checkpoint,
+            resume=args.resume
+        )
+    finally:
+        await graph_client.close()
+        await async_engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill or refresh customer profiles from the Graph API")
+    parser.add_argument("--refresh", action="store_true", help="Refresh stored profiles older than PROFILE_TTL_HOURS")
+    parser.add_argument("--all", action="store_true", help="Refresh every stored profile regardless of age")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows scanned and written per chunk")
+    parser.add_argument("--concurrency", type=int, default=4, help="Graph batch calls in flight at once")
+    parser.add_argument("--checkpoint", help="File storing the last processed id (one default file per mode)")
+    parser.add_argument("--resume", action="store_true", help="Retry the failed lookups and continue after the id stored in the checkpoint file")
+    args = parser.parse_args()
+    if args.checkpoint is None:
+        mode = "refresh" if args.refresh or args.all else "unknown"
+        args.checkpoint = f".backfill_profiles.{mode}.checkpoint"
+
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Reprocess webhook deliveries left unhandled in the inbox.
+
+Usage:
+    python -m app.scripts.replay_webhooks [--batch-size 500] [--min-age 60] [--pending-only]
+
+Events are claimed in id order with FOR UPDATE SKIP LOCKED, so the command can
+run while the API is up and alongside other replay processes.
+
+The API runs the same replay periodically (see WEBHOOK_SWEEP_INTERVAL); this
+command drains a large backlog at once. The new messages are published to
+the WebSocket clients. Only the postgres pub/sub backend reaches the API
+workers from this process; with the memory backend clients get them from the
+database when they reconnect or reload.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from app.core.database import AsyncSessionLocal, async_engine
+from app.core.graph_client import graph_client
+from app.services.webhook_inbox_service import WebhookInboxService
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def replay(batch_size: int, include_failed: bool, max_attempts: int, min_age: float):
+    # New chats may need a Graph API profile lookup
+    await graph_client.start()
+    try:
+        await replay_backlog(batch_size, include_failed, max_attempts, min_age)
+    finally:
+        await graph_client.close()
+        await async_engine.dispose()
+
+async def replay_backlog(batch_size: int, include_failed: bool, max_attempts: int, min_age: float):
+    started = time.monotonic()
+    total = 0
+    last_id = 0
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            events = await WebhookInboxService.claim_backlog(
+                db,
+                batch_size=batch_size,
+                include_failed=include_failed,
+                max_attempts=max_attempts,
+                min_age=timedelta(seconds=min_age),
+                after_id=last_id
+            )
+            # Release the scan locks, each batch is re-claimed in its own transaction
+            await db.commit()
+
+        if not events:
+            break
+        # Only move forward so events failing on every attempt cannot loop forever
+        last_id = events[-1].id
+
+        total += await WebhookInboxService.replay(events)
+        elapsed = time.monotonic() - started
+        logger.info("Replayed %d events (%.1f events/s)", total, total / elapsed if elapsed else 0.0)
+
+    logger.info("Replay finished: %d events in %.1fs", total, time.monotonic() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay unprocessed webhook deliveries from the inbox")
+    parser.add_argument("--batch-size", type=int, default=500, help="Events processed per transaction")
+    parser.add_argument("--pending-only", action="store_true", help="Skip events that already failed")
+    parser.add_argument("--max-attempts", type=int, default=5, help="Give up on events that failed this many times")
+    parser.add_argument(
+        "--min-age", type=float, default=60,
+        help="Only replay events older than this many seconds, leaving fresh ones to the live workers"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(replay(args.batch_size, not args.pending_only, args.max_attempts, args.min_age))
+
+if __name__ == "__main__":
+    main()
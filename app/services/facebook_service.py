@@ -1,10 +1,11 @@
-from typing import Optional
-import requests
+import logging
 from fastapi import HTTPException
 from app.core.config import settings
+from app.core.graph_client import graph_client, GraphAPIError
+
+logger = logging.getLogger(__name__)
 
 class FacebookService:
-    BASE_URL = "https://graph.facebook.com/v18.0"
     OAUTH_URL = "https://www.facebook.com/v18.0/dialog/oauth"
     
     @staticmethod
@@ -24,9 +25,17 @@ class FacebookService:
         return f"{FacebookService.OAUTH_URL}?{query_string}"
     
     @staticmethod
-    def get_access_token(code: str, redirect_uri: str) -> dict:
+    async def _oauth_get(url: str, params: dict):
+        """GET an OAuth endpoint, failing with 503 while the Graph API is unavailable"""
+        try:
+            return await graph_client.get(url, params=params, operation="oauth")
+        except GraphAPIError:
+            raise HTTPException(status_code=503, detail="Facebook is temporarily unavailable")
+    
+    @staticmethod
+    async def get_access_token(code: str, redirect_uri: str) -> dict:
         """Exchange authorization code for access token"""
-        url = f"{FacebookService.BASE_URL}/oauth/access_token"
+        url = "/oauth/access_token"
         params = {
             "client_id": settings.FACEBOOK_APP_ID,
             "client_secret": settings.FACEBOOK_APP_SECRET,
@@ -34,16 +43,17 @@ class FacebookService:
             "code": code
         }
         
-        response = requests.get(url, params=params)
-        print(f"Response by get_access_token: {response.json()}")
+        response = await FacebookService._oauth_get(url, params)
         if response.status_code != 200:
+            # The body only holds an error here, never a token
+            logger.warning("Access token exchange failed with %d: %s", response.status_code, response.text[:200])
             raise HTTPException(status_code=400, detail="Failed to get access token")
         return response.json()
     
     @staticmethod
-    def get_long_lived_token(short_lived_token: str) -> dict:
+    async def get_long_lived_token(short_lived_token: str) -> dict:
         """Exchange short-lived token for a long-lived token"""
-        url = f"{FacebookService.BASE_URL}/oauth/access_token"
+        url = "/oauth/access_token"
         params = {
             "grant_type": "fb_exchange_token",
             "client_id": settings.FACEBOOK_APP_ID,
@@ -51,22 +61,22 @@ class FacebookService:
             "fb_exchange_token": short_lived_token
         }
         
-        response = requests.get(url, params=params)
-        print(f"Response by get_long_lived_token: {response.json()}")
+        response = await FacebookService._oauth_get(url, params)
         if response.status_code != 200:
+            logger.warning("Long-lived token exchange failed with %d: %s", response.status_code, response.text[:200])
             raise HTTPException(status_code=400, detail="Failed to get long-lived token")
         return response.json()
 
     @staticmethod
-    def get_page_access_token(user_access_token: str) -> dict:
+    async def get_page_access_token(user_access_token: str) -> dict:
         """Get page access token and basic page information"""
-        url = f"{FacebookService.BASE_URL}/me/accounts"
+        url = "/me/accounts"
         params = {
             "access_token": user_access_token,
             "fields": "access_token,name,id,picture"
         }
         
-        response = requests.get(url, params=params)
+        response = await FacebookService._oauth_get(url, params)
         if response.status_code != 200:
             raise HTTPException(status_code=400, detail="Failed to get page access token")
         return response.json()
@@ -1,111 +1,459 @@
-import requests
-from typing import Optional, Dict, Any
-from sqlalchemy.orm import Session
+from typing import Optional, Dict, Any, Iterable, List, NamedTuple, Tuple
+import httpx
+from sqlalchemy import bindparam, case, insert, or_, select, text, update, Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 import pytz
 
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.graph_client import graph_client
 from app.models.chat import Chat, Message
-from app.models.user import User
 from app.models.facebook_page import FacebookPage
-from sqlalchemy.orm import joinedload
+from app.services.profile_service import ProfileService
+
+class IncomingMessages(NamedTuple):
+    by_chat: Dict[int, List[Message]]  # Stored messages grouped by chat id
+    chats: Dict[int, Chat]  # Every chat that received messages, by id
+    new_chats: List[Chat]  # Chats created for these messages
+    mids: List[Tuple[str, str]]  # (page id, mid) of every message now stored, new or redelivered
+    duplicates: int = 0  # Redelivered messages found already stored
+
+class RecentMids:
+    """Page-scoped ids of messages stored recently by this worker.
+
+    Facebook redelivers webhooks it did not see acknowledged in time; their
+    messages are dropped here before any query. Ids are only remembered
+    once their transaction committed. What this cache misses is dropped by
+    a lookup of the stored ids before sequence numbers are allocated, and
+    the unique index on (chat_id, fb_message_id) catches concurrent copies.
+    """
+
+    def __init__(self, maxsize: int):
+        self.cache: LRUCache[bool] = LRUCache(maxsize)
+
+        # Metrics
+        self.skipped_cached = 0  # Redelivered messages dropped by the cache
+        self.skipped_stored = 0  # Redelivered messages ignored by the database
+
+    def seen(self, page_id: str, mid: str) -> bool:
+        return self.cache.get((page_id, mid)) is not None
+
+    def remember(self, mids: Iterable[Tuple[str, str]]):
+        for key in mids:
+            self.cache.set(key, True)
+
+    def record(self, incoming: IncomingMessages):
+        """Remember the mids of a committed delivery and count its duplicates"""
+        self.remember(incoming.mids)
+        self.skipped_stored += incoming.duplicates
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "skipped_cached": self.skipped_cached,
+            "skipped_stored": self.skipped_stored,
+            "cache": self.cache.stats(),
+        }
 
 class MessengerService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.fb_api_version = "v18.0"
-        self.fb_graph_url = f"https://graph.facebook.com/{self.fb_api_version}"
-
-    async def handle_incoming_message(self, webhook_event: Dict[str, Any], page_id: str) -> Optional[Message]:
-        """Handle incoming message from Facebook Messenger webhook"""
-        messaging = webhook_event.get("messaging", [{}])[0]
-        sender_id = messaging.get("sender", {}).get("id")
-        recipient_id = messaging.get("recipient", {}).get("id")
-        message = messaging.get("message", {})
-        print("Extract relevant things from webhook data...")
-        if not sender_id or not message:
-            return None
-
-        user = self.db.query(User).join(FacebookPage).filter(FacebookPage.id == page_id).first()
+
+    async def handle_incoming_messages(self, entries: List[Dict[str, Any]], commit: bool = True) -> IncomingMessages:
+        """Handle every messaging event of a Messenger webhook delivery in one pass.
+        
+        Returns the newly stored messages grouped by chat id, with the chats
+        they went to; redelivered messages are skipped. With commit=False
+        the caller owns the transaction and must call ``recent_mids.record``
+        with the result once it committed.
+        """
+        # Flatten all messaging events of all entries
+        events = []
+        for entry in entries:
+            page_id = entry.get("id")
+            for messaging in entry.get("messaging", []):
+                sender_id = messaging.get("sender", {}).get("id")
+                message = messaging.get("message", {})
+                if page_id and sender_id and message:
+                    mid = message.get("mid")
+                    if mid and recent_mids.seen(page_id, mid):
+                        recent_mids.skipped_cached += 1
+                        continue
+                    events.append((page_id, sender_id, messaging))
+        
+        if not events:
+            return IncomingMessages({}, {}, [], [])
+        
+        # Resolve pages once per delivery
+        page_ids = {page_id for page_id, _, _ in events}
+        pages = {
+            page.id: page
+            for page in await self.db.scalars(select(FacebookPage).where(FacebookPage.id.in_(page_ids)))
+        }
+        
+        # Resolve chats once per (page, sender) pair
+        chats: Dict[Tuple[str, str], Chat] = {}
+        new_chats: List[Chat] = []
+        rows = []
+        mids: List[Tuple[str, str]] = []
+        for page_id, sender_id, messaging in events:
+            page = pages.get(page_id)
+            if not page:
+                continue
+            
+            key = (page_id, sender_id)
+            if key not in chats:
+                chats[key], created = await self.get_or_create_chat(page.user_id, sender_id, page)
+                if created:
+                    new_chats.append(chats[key])
+            
+            message = messaging["message"]
+            if message.get("mid"):
+                mids.append((page_id, message["mid"]))
+            rows.append({
+                "chat_id": chats[key].id,
+                "content": message.get("text", ""),
+                "message_type": "incoming",
+                "status": "received",
+                "fb_message_id": message.get("mid"),
+                "timestamp": self._to_ist(messaging.get("timestamp", 0))
+            })
+        
+        if not rows:
+            return IncomingMessages({}, {}, [], [])
+        
+        # Drop messages already stored before numbering, so redeliveries neither lock
+        # their chats nor consume sequence numbers
+        received = len(rows)
+        rows = await self._drop_stored(rows)
+        if rows:
+            # Check again under the chat locks: a worker handling the same redelivery
+            # holds them until its messages are committed
+            await self._lock_chats({row["chat_id"] for row in rows})
+            rows = await self._drop_stored(rows)
+        
+        new_messages = []
+        if rows:
+            # Number the messages of each chat in arrival order
+            counts: Dict[int, int] = {}
+            for row in rows:
+                counts[row["chat_id"]] = counts.get(row["chat_id"], 0) + 1
+            next_seqs = await self._allocate_seqs(counts)
+            for row in rows:
+                row["seq"] = next_seqs[row["chat_id"]]
+                next_seqs[row["chat_id"]] += 1
+            
+            # Single bulk insert for the whole delivery; the unique index is the
+            # last guard against duplicates
+            new_messages = (await self.db.scalars(
+                pg_insert(Message).values(rows).on_conflict_do_nothing(
+                    index_elements=[Message.chat_id, Message.fb_message_id],
+                    index_where=text("message_type = 'incoming'")
+                ).returning(Message)
+            )).all()
+            await self._update_last_messages(new_messages)
         
-        if not user:
-            return None
-        # Get or create chat
-        chat = self.get_or_create_chat(user.id, sender_id)
+        messages_by_chat: Dict[int, List[Message]] = {}
+        for message in new_messages:
+            messages_by_chat.setdefault(message.chat_id, []).append(message)
+        
+        incoming = IncomingMessages(
+            messages_by_chat,
+            {chat.id: chat for chat in chats.values()},
+            new_chats,
+            mids,
+            received - len(new_messages)
+        )
+        if commit:
+            await self.db.commit()
+            recent_mids.record(incoming)
+        return incoming
+
+    async def _drop_stored(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rows whose message is not stored yet, nor repeated earlier in ``rows``"""
+        mids = {row["fb_message_id"] for row in rows if row["fb_message_id"]}
+        seen = set()
+        if mids:
+            seen = {
+                tuple(stored)
+                for stored in await self.db.execute(
+                    select(Message.chat_id, Message.fb_message_id).where(
+                        Message.message_type == "incoming",
+                        Message.fb_message_id.in_(mids)
+                    )
+                )
+            }
         
-        # Convert UTC timestamp to IST
-        utc_timestamp = datetime.fromtimestamp(messaging.get("timestamp", 0) / 1000)
+        fresh = []
+        for row in rows:
+            key = (row["chat_id"], row["fb_message_id"])
+            if row["fb_message_id"]:
+                if key in seen:
+                    continue
+                seen.add(key)
+            fresh.append(row)
+        return fresh
+
+    @staticmethod
+    def _to_ist(timestamp_ms: int) -> datetime:
+        """Convert a Messenger epoch timestamp (ms) to IST wall-clock time"""
+        utc_timestamp = datetime.fromtimestamp(timestamp_ms / 1000)
         ist_timezone = pytz.timezone('Asia/Kolkata')
-        ist_timestamp = utc_timestamp.astimezone(ist_timezone)
+        # Timestamp columns are naive; asyncpg refuses aware datetimes for them
+        return utc_timestamp.astimezone(ist_timezone).replace(tzinfo=None)
+
+    @staticmethod
+    def _now_ist() -> datetime:
+        """Current IST wall-clock time, as message timestamps are stored"""
+        return datetime.now(pytz.timezone('Asia/Kolkata')).replace(tzinfo=None)
+
+    @staticmethod
+    def chat_payload(chat: Chat) -> Dict[str, Any]:
+        """Serialize a chat for WebSocket broadcasts"""
+        return {
+            "id": chat.id,
+            "fb_user_id": chat.fb_user_id,
+            "fb_user_name": chat.fb_user_name,
+            "created_at": chat.created_at.isoformat() if chat.created_at else None
+        }
+
+    @staticmethod
+    def message_payload(message: Message) -> Dict[str, Any]:
+        """Serialize a message for WebSocket broadcasts"""
+        return {
+            "id": message.id,
+            "content": message.content,
+            "message_type": message.message_type,
+            "fb_message_id": message.fb_message_id,
+            "status": message.status,
+            "seq": message.seq,
+            "timestamp": message.timestamp.isoformat()
+        }
+
+    async def _allocate_seqs(self, counts: Dict[int, int]) -> Dict[int, int]:
+        """Reserve ``counts[chat_id]`` sequence numbers in each chat; returns the first of each range.
         
-        # Create message
+        The chats stay locked until commit, so numbers of a chat are committed
+        in order. They are locked in id order so concurrent writers cannot deadlock.
+        """
+        chat_ids = sorted(counts)
+        await self._lock_chats(chat_ids)
+        rows = await self.db.execute(
+            update(Chat.__table__)
+            .where(Chat.id.in_(chat_ids))
+            .values(last_seq=Chat.last_seq + case(counts, value=Chat.id))
+            .returning(Chat.id, Chat.last_seq)
+        )
+        return {chat_id: last_seq - counts[chat_id] + 1 for chat_id, last_seq in rows}
+
+    async def _lock_chats(self, chat_ids: Iterable[int]):
+        """Lock chat rows until commit, in id order so concurrent writers cannot deadlock"""
+        await self.db.execute(
+            select(Chat.id).where(Chat.id.in_(sorted(chat_ids))).order_by(Chat.id).with_for_update()
+        )
+
+    async def get_messages_since(self, chat_id: int, seq: int, limit: int) -> List[Message]:
+        """Messages of a chat created or updated after sequence number ``seq``, in order"""
+        return list(await self.db.scalars(
+            select(Message)
+            .where(Message.chat_id == chat_id, Message.seq > seq)
+            .order_by(Message.seq)
+            .limit(limit)
+        ))
+
+    async def get_chat_page(self, chat: Chat) -> Optional[FacebookPage]:
+        """Facebook page a chat's replies are sent from"""
+        return await self.db.scalar(
+            select(FacebookPage).where(FacebookPage.user_id == chat.user_id).limit(1)
+        )
+
+    async def create_pending_message(self, chat_id: int, message_text: str) -> Message:
+        """Store an outgoing message before it is handed to the send pipeline"""
+        seqs = await self._allocate_seqs({chat_id: 1})
         new_message = Message(
-            chat_id=chat.id,
-            content=message.get("text", ""),
-            message_type="incoming",
-            fb_message_id=message.get("mid"),
-            timestamp=ist_timestamp
+            chat_id=chat_id,
+            content=message_text,
+            message_type="outgoing",
+            status="pending",
+            timestamp=self._now_ist(),
+            seq=seqs[chat_id],
+            claimed_at=datetime.utcnow()
         )
         self.db.add(new_message)
-        self.db.commit()
-        self.db.refresh(new_message)
-        
+        await self.db.flush()
+        await self._update_last_messages([new_message])
+        await self.db.commit()
+        await self.db.refresh(new_message)
         return new_message
 
-    def send_message(self, chat_id: int, message_text: str) -> Optional[str]:
-        """Send message to Facebook user"""
-        chat = self.db.query(Chat).filter(Chat.id == chat_id).first()
-        if not chat:
-            return None
+    async def create_pending_messages(self, chat_ids: List[int], message_text: str) -> List[Row]:
+        """Store the same outgoing message in many chats with a single bulk insert"""
+        ist_timestamp = self._now_ist()
+        claimed_at = datetime.utcnow()
+        seqs = await self._allocate_seqs({chat_id: 1 for chat_id in chat_ids})
+        new_messages = (await self.db.execute(
+            insert(Message).returning(
+                Message.id,
+                Message.chat_id,
+                Message.content,
+                Message.message_type,
+                Message.fb_message_id,
+                Message.status,
+                Message.seq,
+                Message.timestamp,
+                Message.claimed_at
+            ),
+            [
+                {
+                    "chat_id": chat_id,
+                    "content": message_text,
+                    "message_type": "outgoing",
+                    "status": "pending",
+                    "timestamp": ist_timestamp,
+                    "seq": seqs[chat_id],
+                    "claimed_at": claimed_at
+                }
+                for chat_id in chat_ids
+            ]
+        )).all()
+        await self._update_last_messages(new_messages)
+        await self.db.commit()
+        return new_messages
 
-        user = self.db.query(User).filter(User.id == chat.user_id).first()
-        if not user or not user.fb_page_token:
-            return None
+    async def _update_last_messages(self, messages):
+        """Move the inbox summary of each chat to its newest message, in one statement"""
+        latest = {}
+        for message in messages:
+            current = latest.get(message.chat_id)
+            if current is None or (message.timestamp, message.id) > (current.timestamp, current.id):
+                latest[message.chat_id] = message
+        if not latest:
+            return
+        
+        statement = (
+            update(Chat.__table__)
+            .where(
+                Chat.id == bindparam("b_chat_id"),
+                or_(Chat.last_message_at.is_(None), Chat.last_message_at <= bindparam("b_at"))
+            )
+            .values(
+                last_message_preview=bindparam("b_preview"),
+                last_message_at=bindparam("b_at"),
+                last_message_type=bindparam("b_type")
+            )
+        )
+        await self.db.execute(statement, [
+            {
+                "b_chat_id": chat_id,
+                "b_preview": (message.content or "")[:settings.INBOX_PREVIEW_LENGTH],
+                "b_at": message.timestamp,
+                "b_type": message.message_type
+            }
+            for chat_id, message in latest.items()
+        ])
 
-        url = f"{self.fb_graph_url}/me/messages"
-        headers = {
-            "Content-Type": "application/json"
-        }
+    async def complete_outgoing_message(
+        self,
+        message_id: int,
+        chat_id: int,
+        fb_message_id: Optional[str] = None,
+        error: Optional[str] = None
+    ) -> Optional[Message]:
+        """Record the final delivery status of an outgoing message, as a new change of its chat"""
+        seqs = await self._allocate_seqs({chat_id: 1})
+        message = (await self.db.scalars(
+            update(Message)
+            .where(Message.id == message_id)
+            .values(
+                status="failed" if error else "sent",
+                fb_message_id=fb_message_id,
+                error=error,
+                seq=seqs[chat_id]
+            )
+            .returning(Message)
+        )).first()
+        await self.db.commit()
+        return message
+
+    async def claim_expired_outgoing_messages(self, limit: int) -> List[Message]:
+        """Take over pending outgoing messages whose send lease expired, oldest first.
+
+        Rows are claimed with SKIP LOCKED, so concurrent workers split them
+        instead of queueing the same messages.
+        """
+        now = datetime.utcnow()
+        expired = (
+            select(Message.id)
+            .where(
+                Message.message_type == "outgoing",
+                Message.status == "pending",
+                or_(
+                    Message.claimed_at.is_(None),
+                    Message.claimed_at < now - timedelta(seconds=settings.SEND_CLAIM_LEASE_SECONDS)
+                )
+            )
+            .order_by(Message.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        messages = (await self.db.scalars(
+            update(Message)
+            .where(Message.id.in_(expired.scalar_subquery()))
+            # A new lease is not a change of the message
+            .values(claimed_at=now, updated_at=Message.updated_at)
+            .returning(Message)
+        )).all()
+        await self.db.commit()
+        return sorted(messages, key=lambda message: message.id)
+
+    async def renew_send_claim(self, message_id: int, claimed_at: datetime) -> Optional[datetime]:
+        """Extend the lease on a pending outgoing message, if it is still ours.
+
+        Returns the new lease start, or None when the message is no longer
+        pending or another worker took it over.
+        """
+        renewed = await self.db.scalar(
+            update(Message)
+            .where(
+                Message.id == message_id,
+                Message.status == "pending",
+                Message.claimed_at == claimed_at
+            )
+            .values(claimed_at=datetime.utcnow(), updated_at=Message.updated_at)
+            .returning(Message.claimed_at)
+        )
+        await self.db.commit()
+        return renewed
+
+    @staticmethod
+    async def post_message(page_access_token: str, recipient_id: str, message_text: str) -> httpx.Response:
+        """Send message to Facebook user (raises GraphAPIError if Facebook cannot be reached)"""
         data = {
-            "recipient": {"id": chat.fb_user_id},
+            "recipient": {"id": recipient_id},
             "message": {"text": message_text}
         }
-
-        response = requests.post(
-            url,
-            headers=headers,
+        return await graph_client.post(
+            "/me/messages",
             json=data,
-            params={"access_token": user.fb_page_token}
+            params={"access_token": page_access_token},
+            operation="send"
         )
 
-        if response.status_code == 200:
-            # Save the sent message with IST timestamp
-            ist_timezone = pytz.timezone('Asia/Kolkata')
-            ist_timestamp = datetime.now(ist_timezone)
-            
-            new_message = Message(
-                chat_id=chat.id,
-                content=message_text,
-                message_type="outgoing",
-                fb_message_id=response.json().get("message_id"),
-                timestamp=ist_timestamp
-            )
-            self.db.add(new_message)
-            self.db.commit()
-            return response.json().get("message_id")
+    async def get_or_create_chat(self, user_id: int, fb_user_id: str, page: Optional[FacebookPage] = None) -> Tuple[Chat, bool]:
+        """Get existing chat or create new one; the flag tells whether it was created.
         
-        return None
-
-    def get_or_create_chat(self, user_id: int, fb_user_id: str) -> Chat:
-        """Get existing chat or create new one"""
+        New chats are flushed, not committed, so they share the caller's transaction.
+        """
         # Get the most recent chat and its last message
-        chat = (
-            self.db.query(Chat)
-            .filter(
+        chat = await self.db.scalar(
+            select(Chat)
+            .where(
                 Chat.user_id == user_id,
                 Chat.fb_user_id == fb_user_id
             )
             .order_by(Chat.created_at.desc())
-            .first()
+            .limit(1)
         )
 
         create_new_chat = False
@@ -113,11 +461,11 @@ class MessengerService:
             create_new_chat = True
         else:
             # Get the last message from this chat
-            last_message = (
-                self.db.query(Message)
-                .filter(Message.chat_id == chat.id)
+            last_message = await self.db.scalar(
+                select(Message)
+                .where(Message.chat_id == chat.id)
                 .order_by(Message.timestamp.desc())
-                .first()
+                .limit(1)
             )
             
             # Create new chat if last message is more than 24 hours old
@@ -132,13 +480,16 @@ class MessengerService:
                     create_new_chat = True
 
         if create_new_chat:
-            # Get user info from Facebook
-            user = self.db.query(User).filter(User.id == user_id).first()
-            if user and user.fb_page_token:
-                user_info = self.get_fb_user_info(fb_user_id, user.fb_page_token)
-                fb_user_name = user_info.get("name", "Unknown User")
-            else:
-                fb_user_name = "Unknown User"
+            # Get the customer profile, from Facebook only the first time we see them
+            if page is None:
+                page = await self.db.scalar(
+                    select(FacebookPage).where(FacebookPage.user_id == user_id).limit(1)
+                )
+            
+            profile = None
+            if page:
+                profile = await ProfileService(self.db).get_profile(page.id, fb_user_id, page.access_token)
+            fb_user_name = (profile.name if profile else None) or "Unknown User"
 
             chat = Chat(
                 user_id=user_id,
@@ -146,18 +497,13 @@ class MessengerService:
                 fb_user_name=fb_user_name
             )
             self.db.add(chat)
-            self.db.commit()
+            await self.db.flush()
 
-        return chat
+        return chat, create_new_chat
 
-    def get_fb_user_info(self, user_id: str, access_token: str) -> Dict[str, Any]:
+    async def get_fb_user_info(self, user_id: str, access_token: str) -> Dict[str, Any]:
         """Get Facebook user information"""
-        url = f"{self.fb_graph_url}/{user_id}"
-        response = requests.get(
-            url,
-            params={
-                "access_token": access_token,
-                "fields": "name,profile_pic"
-            }
-        )
-        return response.json() if response.status_code == 200 else {} 
\ No newline at end of file
+        return await ProfileService.fetch_from_graph(user_id, access_token)
+
+# Create a global instance
+recent_mids = RecentMids(settings.WEBHOOK_DEDUP_CACHE_SIZE)
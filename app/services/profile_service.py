@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.graph_client import graph_client, GraphAPIError
+from app.models.customer_profile import CustomerProfile
+
+logger = logging.getLogger(__name__)
+
+class CachedProfile(NamedTuple):
+    name: Optional[str]
+    profile_pic: Optional[str]
+    fetched_at: datetime
+
+# Profiles by (page_id, psid), shared by every request of this process
+profile_cache: LRUCache[CachedProfile] = LRUCache(settings.PROFILE_CACHE_SIZE)
+
+# Profiles stored by a session only enter the cache once its transaction commits
+@event.listens_for(Session, "after_commit")
+def _cache_stored_profiles(session: Session):
+    for key, profile in session.info.pop("stored_profiles", {}).items():
+        profile_cache.set(key, profile)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_stored_profiles(session: Session):
+    session.info.pop("stored_profiles", None)
+
+class ProfileService:
+    """Customer profiles served from the LRU cache, then the database, then the Graph API.
+
+    Profiles older than ``PROFILE_TTL_HOURS`` are still returned but refreshed
+    in the background, so returning customers never wait on the network.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_profile(self, page_id: str, psid: str, access_token: Optional[str]) -> Optional[CachedProfile]:
+        """Get a customer profile, fetching it from Facebook only if it was never stored"""
+        key = (page_id, psid)
+        profile = profile_cache.get(key)
+
+        if profile is None:
+            row = await self.db.scalar(
+                select(CustomerProfile)
+                .where(CustomerProfile.page_id == page_id, CustomerProfile.psid == psid)
+            )
+            if row:
+                profile = CachedProfile(row.name, row.profile_pic, row.fetched_at)
+                profile_cache.set(key, profile)
+
+        if profile is None:
+            if not access_token:
+                return None
+            user_info = await ProfileService.fetch_from_graph(psid, access_token)
+            if not user_info:
+                return None
+            # Part of the caller's transaction, committed with the chat it is fetched for
+            return await ProfileService.store(self.db, page_id, psid, user_info, commit=False)
+
+        if access_token and ProfileService.is_stale(profile):
+            profile_refresher.schedule(page_id, psid, access_token)
+
+        return profile
+
+    @staticmethod
+    def is_stale(profile: CachedProfile) -> bool:
+        return datetime.utcnow() - profile.fetched_at > timedelta(hours=settings.PROFILE_TTL_HOURS)
+
+    @staticmethod
+    async def fetch_from_graph(psid: str, access_token: str) -> Dict[str, Any]:
+        """Get Facebook user information"""
+        try:
+            response = await graph_client.get(
+                f"/{psid}",
+                params={
+                    "access_token": access_token,
+                    "fields": "name,profile_pic"
+                },
+                operation="profile"
+            )
+        except GraphAPIError:
+            return {}
+        return response.json() if response.status_code == 200 else {}
+
+    @staticmethod
+    async def store(db: AsyncSession, page_id: str, psid: str, user_info: Dict[str, Any], commit: bool = True) -> CachedProfile:
+        """Upsert a fetched profile; it is cached once the transaction commits"""
+        profile = CachedProfile(user_info.get("name"), user_info.get("profile_pic"), datetime.utcnow())
+        statement = insert(CustomerProfile).values(
+            page_id=page_id,
+            psid=psid,
+            name=profile.name,
+            profile_pic=profile.profile_pic,
+            fetched_at=profile.fetched_at
+        )
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[CustomerProfile.page_id, CustomerProfile.psid],
+            set_={
+                "name": statement.excluded.name,
+                "profile_pic": statement.excluded.profile_pic,
+                "fetched_at": statement.excluded.fetched_at
+            }
+        ))
+        db.info.setdefault("stored_profiles", {})[(page_id, psid)] = profile
+        if commit:
+            await db.commit()
+        return profile
+
+class ProfileRefresher:
+    """Refreshes stale profiles in background tasks, one task per profile at a time"""
+
+    def __init__(self, concurrency: int):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: Set[Tuple[str, str]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.refreshed = 0
+        self.failed = 0
+
+    def schedule(self, page_id: str, psid: str, access_token: str):
+        key = (page_id, psid)
+        if key in self._in_flight:
+            return
+        self._in_flight.add(key)
+        task = asyncio.create_task(self._refresh(page_id, psid, access_token))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, page_id: str, psid: str, access_token: str):
+        try:
+            async with self._semaphore:
+                user_info = await ProfileService.fetch_from_graph(psid, access_token)
+                if not user_info:
+                    self.failed += 1
+                    return
+                async with AsyncSessionLocal() as db:
+                    await ProfileService.store(db, page_id, psid, user_info)
+                self.refreshed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Failed to refresh profile %s of page %s", psid, page_id)
+        finally:
+            self._in_flight.discard((page_id, psid))
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._in_flight),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
+
+# Create a global instance
+profile_refresher = ProfileRefresher(settings.PROFILE_REFRESH_CONCURRENCY)
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.graph_client import GraphAPIError
+from app.core.resilience import TokenBucket
+from app.core.websocket import manager
+from app.models.chat import Chat
+from app.services.messenger_service import MessengerService
+
+logger = logging.getLogger(__name__)
+
+class SendQueueFull(Exception):
+    """Raised when a page's send queue cannot take more messages"""
+
+@dataclass
+class SendJob:
+    message_id: int
+    chat_id: int
+    user_id: int  # Owner of the chat, whose sockets get the status updates
+    page_id: str
+    page_access_token: str
+    recipient_id: str
+    text: str
+    claimed_at: datetime  # Lease on the pending row, renewed before every attempt
+    attempts: int = 0
+    done: Optional[asyncio.Future] = field(default=None, repr=False)
+
+class PageSender:
+    """Delivery lanes of one Facebook page, sharing the page's token bucket.
+
+    Jobs are sharded over the lanes by chat id, so messages of a chat keep
+    their order while different chats of the page are sent in parallel.
+    """
+
+    def __init__(self, pipeline: "SendPipeline", page_id: str):
+        self.pipeline = pipeline
+        self.page_id = page_id
+        self.bucket = TokenBucket(settings.SEND_RATE_PER_PAGE, settings.SEND_BURST_PER_PAGE)
+        self.lanes: List[asyncio.Queue] = [
+            asyncio.Queue(maxsize=settings.SEND_QUEUE_MAXSIZE)
+            for _ in range(settings.SEND_WORKERS_PER_PAGE)
+        ]
+        self.tasks = [
+            asyncio.create_task(self._worker(lane), name=f"send-{page_id}-{index}")
+            for index, lane in enumerate(self.lanes)
+        ]
+
+    @property
+    def depth(self) -> int:
+        return sum(lane.qsize() for lane in self.lanes)
+
+    def put(self, job: SendJob):
+        lane = self.lanes[job.chat_id % len(self.lanes)]
+        try:
+            lane.put_nowait(job)
+        except asyncio.QueueFull:
+            raise SendQueueFull()
+
+    async def join(self):
+        await asyncio.gather(*(lane.join() for lane in self.lanes))
+
+    async def _worker(self, lane: asyncio.Queue):
+        while True:
+            job = await lane.get()
+            try:
+                await self.pipeline.deliver(job, self.bucket)
+            except Exception as e:
+                logger.exception("Send worker of page %s failed on message %d", self.page_id, job.message_id)
+                if job.done and not job.done.done():
+                    job.done.set_exception(e)
+            finally:
+                lane.task_done()
+
+class SendPipeline:
+    """Delivers outgoing messages to the Graph API in the background.
+
+    The send endpoint stores the message as ``pending`` and returns; a
+    per-page sender rate limits and retries the Graph call, then records
+    ``sent`` or ``failed`` and broadcasts a ``message_status`` event to the chat.
+
+    Pending rows carry a lease (``claimed_at``) held by the worker that
+    queued them. Workers periodically take over rows whose lease expired,
+    and a job whose lease was taken over is dropped instead of sent.
+    """
+
+    def __init__(self):
+        self.senders: Dict[str, PageSender] = {}
+        self.running = False
+        self.recover_task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.recovered = 0
+        self.taken_over = 0
+
+    async def start(self):
+        """Start accepting jobs and take over pending messages whose lease expired"""
+        self.running = True
+        await self.recover()
+        self.recover_task = asyncio.create_task(self._recover_loop(), name="send-recover")
+
+    async def stop(self, timeout: float = 10.0):
+        """Wait for queued sends to finish, then cancel the workers.
+
+        Messages still queued stay pending in the database and are re-queued
+        by any worker once their lease expires.
+        """
+        self.running = False
+        if self.recover_task:
+            self.recover_task.cancel()
+            await asyncio.gather(self.recover_task, return_exceptions=True)
+            self.recover_task = None
+        senders = list(self.senders.values())
+        try:
+            await asyncio.wait_for(asyncio.gather(*(sender.join() for sender in senders)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Send pipeline not drained on shutdown, %d messages left pending", self.depth)
+
+        tasks = [task for sender in senders for task in sender.tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.senders = {}
+
+    @property
+    def depth(self) -> int:
+        return sum(sender.depth for sender in self.senders.values())
+
+    def enqueue(self, job: SendJob, wait: bool = False) -> Optional[asyncio.Future]:
+        """Queue a stored pending message for delivery.
+
+        With ``wait`` a future is returned that resolves with the final
+        message payload; callers that do not await it must not ask for one.
+        """
+        if not self.running:
+            raise RuntimeError("Send pipeline is not running")
+
+        sender = self.senders.get(job.page_id)
+        if sender is None:
+            sender = self.senders[job.page_id] = PageSender(self, job.page_id)
+
+        if wait:
+            job.done = asyncio.get_running_loop().create_future()
+        sender.put(job)
+        return job.done
+
+    async def deliver(self, job: SendJob, bucket: TokenBucket):
+        """Send one message, retrying transient failures with exponential backoff"""
+        while True:
+            await bucket.acquire()
+            if not await self._renew_claim(job):
+                self.taken_over += 1
+                logger.info("Message %d was taken over by another send worker", job.message_id)
+                if job.done and not job.done.done():
+                    job.done.set_result(None)
+                return
+            job.attempts += 1
+
+            fb_message_id = None
+            error = None
+            retryable = False
+            try:
+                response = await MessengerService.post_message(job.page_access_token, job.recipient_id, job.text)
+                if response.status_code == 200:
+                    fb_message_id = response.json().get("message_id")
+                else:
+                    error = f"Graph API returned {response.status_code}"
+                    retryable = response.status_code == 429 or response.status_code >= 500
+            except GraphAPIError as e:
+                error = str(e)
+                retryable = True
+
+            if error and retryable and job.attempts <= settings.SEND_MAX_RETRIES:
+                self.retries += 1
+                await asyncio.sleep(settings.SEND_RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+                continue
+
+            await self.complete(job, fb_message_id, error)
+            return
+
+    async def _renew_claim(self, job: SendJob) -> bool:
+        async with AsyncSessionLocal() as db:
+            claimed_at = await MessengerService(db).renew_send_claim(job.message_id, job.claimed_at)
+        if claimed_at is None:
+            return False
+        job.claimed_at = claimed_at
+        return True
+
+    async def complete(self, job: SendJob, fb_message_id: Optional[str], error: Optional[str]):
+        """Store the delivery outcome and push it to the chat's WebSocket clients"""
+        if error:
+            self.failed += 1
+        else:
+            self.sent += 1
+
+        async with AsyncSessionLocal() as db:
+            message = await MessengerService(db).complete_outgoing_message(job.message_id, job.chat_id, fb_message_id, error)
+
+        payload = MessengerService.message_payload(message) if message else None
+        if payload:
+            await manager.broadcast_to_chat(job.chat_id, job.user_id, {
+                "type": "message_status",
+                "data": payload
+            }, message.seq)
+        if job.done and not job.done.done():
+            job.done.set_result(payload)
+
+    async def recover(self):
+        """Claim and re-queue outgoing messages whose send lease expired"""
+        total = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                messenger_service = MessengerService(db)
+                messages = await messenger_service.claim_expired_outgoing_messages(settings.SEND_RECOVER_BATCH_SIZE)
+                chats = {
+                    chat.id: chat
+                    for chat in await db.scalars(select(Chat).where(Chat.id.in_({message.chat_id for message in messages})))
+                } if messages else {}
+                pages = {}
+                jobs = []
+                for message in messages:
+                    chat = chats[message.chat_id]
+                    if chat.user_id not in pages:
+                        pages[chat.user_id] = await messenger_service.get_chat_page(chat)
+                    page = pages[chat.user_id]
+                    if page:
+                        jobs.append(SendJob(
+                            message.id, chat.id, chat.user_id, page.id, page.access_token,
+                            chat.fb_user_id, message.content, message.claimed_at
+                        ))
+
+            full = False
+            for job in jobs:
+                try:
+                    self.enqueue(job)
+                    total += 1
+                except SendQueueFull:
+                    # Claimed but not queued: re-queued once the lease expires
+                    full = True
+            if full:
+                logger.warning("Send queue full, some claimed messages wait for their lease to expire")
+            if full or len(messages) < settings.SEND_RECOVER_BATCH_SIZE:
+                break
+
+        self.recovered += total
+        if total:
+            logger.info("Re-queued %d pending outgoing messages", total)
+
+    async def _recover_loop(self):
+        while True:
+            await asyncio.sleep(settings.SEND_RECOVER_INTERVAL)
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception("Recovering pending outgoing messages failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "pages": len(self.senders),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "recovered": self.recovered,
+            "taken_over": self.taken_over,
+        }
+
+# Create a global instance
+send_pipeline = SendPipeline()
@@ -1,37 +1,178 @@
-from sqlalchemy.orm import Session
+import asyncio
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 from app.models.user import User
 from app.schemas.user import UserCreate
-from app.core.security import get_password_hash, verify_password
-from typing import Optional
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.pubsub import PubSub
+from app.core.security import password_hasher
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class Principal(NamedTuple):
+    """Authenticated caller, detached from any database session"""
+    id: int
+    email: str
+    full_name: Optional[str]
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.email, user.full_name, user.is_active, user.created_at)
+
+class PrincipalCache:
+    """Verified access tokens mapped to their principal.
+
+    Entries live for ``PRINCIPAL_CACHE_TTL_SECONDS`` at most and never past
+    the token's own expiry. Once a transaction changing or deleting a user
+    through the ORM commits, every cached token of that user is dropped in
+    this process and the user id is published on the pub/sub, so every other
+    worker drops them too. After a pub/sub outage the whole cache is cleared.
+    """
+
+    CHANNEL = "principal_invalidate"
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache: TTLCache[Principal] = TTLCache(maxsize, ttl)
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._pubsub: Optional[PubSub] = None
+        self._publishing: Set[asyncio.Task] = set()
+        self.invalidations = 0
+        self.published = 0
+
+    async def start(self, pubsub: PubSub):
+        """Receive the invalidations published by every worker"""
+        self._pubsub = pubsub
+        await pubsub.listen(self.CHANNEL, self._on_invalidation, self._on_reconnect)
+
+    async def stop(self):
+        if self._publishing:
+            await asyncio.gather(*self._publishing, return_exceptions=True)
+        self._pubsub = None
+
+    def get(self, token: str) -> Optional[Principal]:
+        return self._cache.get(token)
+
+    def set(self, token: str, principal: Principal, expires_at: Optional[float] = None):
+        """Cache a principal, for no longer than the token's ``exp`` (epoch seconds)"""
+        ttl = self._cache.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+        self._cache.set(token, principal, ttl=ttl)
+        # Forget tokens of this user that were evicted or expired meanwhile
+        tokens = {t for t in self._tokens_by_user.get(principal.id, ()) if t in self._cache}
+        tokens.add(token)
+        self._tokens_by_user[principal.id] = tokens
+
+    def invalidate_user(self, user_id: int):
+        for token in self._tokens_by_user.pop(user_id, ()):
+            self._cache.pop(token)
+        self.invalidations += 1
+
+    def publish_invalidation(self, user_id: int):
+        """Drop a user's tokens here now and on every worker once the pub/sub delivers it"""
+        self.invalidate_user(user_id)
+        if self._pubsub is None:
+            return
+        task = asyncio.get_running_loop().create_task(self._publish(user_id))
+        self._publishing.add(task)
+        task.add_done_callback(self._publishing.discard)
+
+    async def _publish(self, user_id: int):
+        try:
+            await self._pubsub.publish(self.CHANNEL, str(user_id))
+            self.published += 1
+        except Exception:
+            logger.exception("Failed to publish the invalidation of user %d", user_id)
+
+    async def _on_invalidation(self, channel: str, payload: str):
+        self.invalidate_user(int(payload))
+
+    async def _on_reconnect(self):
+        # Invalidations published while the listener was down are lost
+        self.clear()
+
+    def clear(self):
+        self._cache.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats["invalidations"] = self.invalidations
+        stats["published"] = self.published
+        return stats
+
+# Create a global instance
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+# Users changed by a session are invalidated once its transaction commits
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target: User):
+    session = object_session(target)
+    if session is None:
+        principal_cache.publish_invalidation(target.id)
+        return
+    session.info.setdefault("changed_users", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _publish_changed_users(session: Session):
+    for user_id in session.info.pop("changed_users", ()):
+        principal_cache.publish_invalidation(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session: Session):
+    session.info.pop("changed_users", None)
 
 class UserService:
     
     @staticmethod
-    def create_user(db: Session, user: UserCreate) -> User:
-        hashed_password = get_password_hash(user.password)
+    async def create_user(db: AsyncSession, user: UserCreate) -> User:
+        hashed_password = await password_hasher.hash(user.password)
         db_user = User(
             email=user.email,
             hashed_password=hashed_password,
             full_name=user.full_name
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         return db_user
     
     @staticmethod
-    def get_user_by_email(db: Session, email: str) -> Optional[User]:
-        return db.query(User).filter(User.email == email).first()
+    async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+        return await db.scalar(select(User).where(User.email == email))
     
     @staticmethod
-    def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
-        return db.query(User).filter(User.id == user_id).first()
+    async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
+        return await db.scalar(select(User).where(User.id == user_id))
     
     @staticmethod
-    def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-        user = UserService.get_user_by_email(db, email)
+    async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[User]:
+        user = await UserService.get_user_by_email(db, email)
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
+        valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not valid:
             return None
-        return user
\ No newline at end of file
+        if new_hash:
+            # Upgrade hashes made with an older scheme or cost while we have the password
+            user.hashed_password = new_hash
+            await db.commit()
+        return user
+    
+    @staticmethod
+    async def set_active(db: AsyncSession, user: User, is_active: bool) -> User:
+        """Activate or deactivate a user; their cached principals are dropped on every worker on commit"""
+        user.is_active = is_active
+        await db.commit()
+        return user
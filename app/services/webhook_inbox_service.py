@@ -0,0 +1,264 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import json_codec
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.websocket import manager
+from app.models.webhook_event import WebhookEvent
+from app.services.messenger_service import IncomingMessages, MessengerService, recent_mids
+
+logger = logging.getLogger(__name__)
+
+class WebhookInboxService:
+    """Durable inbox for raw webhook deliveries.
+
+    Every verified delivery is appended to ``webhook_events`` before it is
+    acknowledged. Processing claims rows with ``FOR UPDATE SKIP LOCKED`` and
+    marks them processed in the same transaction as the messages they produce,
+    so live workers and the replay command never handle an event twice.
+    """
+
+    @staticmethod
+    async def record(db: AsyncSession, payload: bytes) -> int:
+        """Append a raw delivery to the inbox and return its id"""
+        event_id = (await db.execute(
+            insert(WebhookEvent)
+            .values(payload=payload.decode("utf-8"), status="pending", attempts=0)
+            .returning(WebhookEvent.id)
+        )).scalar_one()
+        await db.commit()
+        return event_id
+
+    @staticmethod
+    async def claim(db: AsyncSession, event_ids: List[int]) -> List[int]:
+        """Lock the given events if they still need processing"""
+        ids = await db.scalars(
+            select(WebhookEvent.id)
+            .where(
+                WebhookEvent.id.in_(event_ids),
+                WebhookEvent.status != "processed"
+            )
+            .with_for_update(skip_locked=True)
+        )
+        return list(ids)
+
+    @staticmethod
+    async def claim_backlog(
+        db: AsyncSession,
+        batch_size: int,
+        include_failed: bool = True,
+        max_attempts: int = 5,
+        min_age: Optional[timedelta] = None,
+        after_id: int = 0
+    ) -> List[WebhookEvent]:
+        """Lock the oldest unprocessed events after ``after_id`` for replay"""
+        statuses = ["pending", "failed"] if include_failed else ["pending"]
+        query = select(WebhookEvent).where(
+            WebhookEvent.id > after_id,
+            WebhookEvent.status.in_(statuses),
+            WebhookEvent.attempts < max_attempts
+        )
+        if min_age is not None:
+            query = query.where(WebhookEvent.received_at <= datetime.utcnow() - min_age)
+
+        events = await db.scalars(
+            query.order_by(WebhookEvent.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        return list(events)
+
+    @staticmethod
+    async def process(db: AsyncSession, event_ids: List[int], bodies: List[Dict[str, Any]]) -> IncomingMessages:
+        """Run claimed events through the messenger pipeline and mark them processed"""
+        entries = []
+        for body in bodies:
+            if body.get("object") == "page":
+                entries.extend(body.get("entry", []))
+
+        messenger_service = MessengerService(db)
+        incoming = await messenger_service.handle_incoming_messages(entries, commit=False)
+
+        await db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id.in_(event_ids))
+            .values(
+                status="processed",
+                attempts=WebhookEvent.attempts + 1,
+                last_error=None,
+                processed_at=datetime.utcnow()
+            )
+        )
+        await db.commit()
+        recent_mids.record(incoming)
+
+        return incoming
+
+    @staticmethod
+    async def broadcast(incoming: IncomingMessages):
+        """Push processed events to the WebSocket clients, on any worker"""
+        # Announce new conversations to the agents' inbox sockets
+        for chat in incoming.new_chats:
+            await manager.broadcast_to_user(chat.user_id, {
+                "type": "new_chat",
+                "chat_id": chat.id,
+                "data": MessengerService.chat_payload(chat)
+            })
+
+        # Broadcast the new messages to connected clients, once per chat
+        for chat_id, messages in incoming.by_chat.items():
+            user_id = incoming.chats[chat_id].user_id
+            if len(messages) == 1:
+                await manager.broadcast_to_chat(chat_id, user_id, {
+                    "type": "new_message",
+                    "data": MessengerService.message_payload(messages[0])
+                }, messages[0].seq)
+            else:
+                await manager.broadcast_to_chat(chat_id, user_id, {
+                    "type": "new_messages",
+                    "data": [MessengerService.message_payload(message) for message in messages]
+                }, max(message.seq for message in messages), min(message.seq for message in messages))
+
+    @staticmethod
+    async def mark_failed(db: AsyncSession, event_ids: List[int], error: str):
+        """Record a failed processing attempt so the replay command retries it"""
+        await db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id.in_(event_ids))
+            .values(
+                status="failed",
+                attempts=WebhookEvent.attempts + 1,
+                last_error=error
+            )
+        )
+        await db.commit()
+
+    @staticmethod
+    def parse(event: WebhookEvent) -> Dict[str, Any]:
+        return json_codec.loads(event.payload)
+
+    @staticmethod
+    async def replay(events: List[WebhookEvent]) -> int:
+        """Process backlog events in one transaction, falling back to one event at a time.
+
+        Returns the number of events processed; their messages are broadcast.
+        """
+        async with AsyncSessionLocal() as db:
+            try:
+                event_ids = [event.id for event in events]
+                claimed = await WebhookInboxService.claim(db, event_ids)
+                if not claimed:
+                    return 0
+                claimed_ids = set(claimed)
+                bodies = [WebhookInboxService.parse(event) for event in events if event.id in claimed_ids]
+                incoming = await WebhookInboxService.process(db, claimed, bodies)
+            except Exception as e:
+                await db.rollback()
+                logger.warning("Batch of %d events failed (%s), retrying one by one", len(events), e)
+            else:
+                await WebhookInboxService.broadcast(incoming)
+                return len(claimed)
+
+        replayed = 0
+        for event in events:
+            async with AsyncSessionLocal() as db:
+                try:
+                    if not await WebhookInboxService.claim(db, [event.id]):
+                        continue
+                    incoming = await WebhookInboxService.process(db, [event.id], [WebhookInboxService.parse(event)])
+                except Exception as e:
+                    await db.rollback()
+                    logger.error("Webhook event %d failed: %s", event.id, e)
+                    await WebhookInboxService.mark_failed(db, [event.id], str(e))
+                    continue
+            await WebhookInboxService.broadcast(incoming)
+            replayed += 1
+        return replayed
+
+class WebhookInboxSweeper:
+    """Replays the inbox backlog from inside the API.
+
+    Every ``interval`` seconds the events still pending or failed after
+    ``min_age`` seconds (deferred on overflow, lost with a crashed worker or
+    failed) are reprocessed and their messages broadcast. Events are claimed
+    with SKIP LOCKED, so every API worker can run a sweeper.
+    """
+
+    def __init__(self, interval: float, min_age: float, batch_size: int, max_attempts: int):
+        self.interval = interval
+        self.min_age = min_age
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.sweeps = 0
+        self.replayed = 0
+
+    async def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop(), name="webhook-sweeper")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                replayed = await self.sweep()
+            except Exception:
+                logger.exception("Webhook inbox sweep failed")
+                continue
+            if replayed:
+                logger.warning("Replayed %d webhook events left in the inbox", replayed)
+
+    async def sweep(self) -> int:
+        """Reprocess the whole backlog once; returns the number of events processed"""
+        self.sweeps += 1
+        total = 0
+        last_id = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                events = await WebhookInboxService.claim_backlog(
+                    db,
+                    batch_size=self.batch_size,
+                    max_attempts=self.max_attempts,
+                    min_age=timedelta(seconds=self.min_age),
+                    after_id=last_id
+                )
+                # Release the scan locks, each batch is re-claimed in its own transaction
+                await db.commit()
+
+            if not events:
+                break
+            # Only move forward so events failing on every attempt are retried on the next sweep, not now
+            last_id = events[-1].id
+            total += await WebhookInboxService.replay(events)
+
+        self.replayed += total
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "sweeps": self.sweeps,
+            "replayed": self.replayed,
+        }
+
+# Create a global instance
+webhook_sweeper = WebhookInboxSweeper(
+    interval=settings.WEBHOOK_SWEEP_INTERVAL,
+    min_age=settings.WEBHOOK_SWEEP_MIN_AGE,
+    batch_size=settings.WEBHOOK_SWEEP_BATCH_SIZE,
+    max_attempts=settings.WEBHOOK_SWEEP_MAX_ATTEMPTS
+)
@@ -0,0 +1,75 @@
+"""Measure throughput of an API endpoint under concurrent requests.
+
+Usage:
+    python benchmarks/concurrent_requests.py --token <JWT> [--path /api/messenger/inbox]
+        [--url http://localhost:8000] [--concurrency 50] [--requests 2000]
+
+Start the API with a single worker (``uvicorn app.main:app --workers 1``)
+and run the benchmark once per build to compare them, e.g. before and after
+the switch to the async database layer. With sync sessions inside async
+handlers every query blocks the event loop, so throughput stays flat as
+concurrency grows; with the async layer it scales until the pool is busy.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+async def worker(client: httpx.AsyncClient, path: str, remaining: List[int], latencies: List[float], errors: List[int]):
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors[0] += 1
+        except httpx.HTTPError:
+            errors[0] += 1
+        latencies.append(time.perf_counter() - started)
+
+async def run(url: str, path: str, token: str, concurrency: int, total: int, warmup: int):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=60) as client:
+        # Open the connections and warm the server-side pools first
+        await asyncio.gather(*(client.get(path) for _ in range(warmup)))
+
+        remaining = [total]
+        latencies: List[float] = []
+        errors = [0]
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, path, remaining, latencies, errors)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"GET {path}: {total} requests, concurrency {concurrency}")
+    print(f"  throughput  {total / elapsed:10.1f} req/s")
+    print(f"  latency p50 {percentile(0.50):10.1f} ms")
+    print(f"  latency p95 {percentile(0.95):10.1f} ms")
+    print(f"  latency p99 {percentile(0.99):10.1f} ms")
+    print(f"  latency avg {statistics.mean(latencies) * 1000:10.1f} ms")
+    print(f"  errors      {errors[0]:10d}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent request throughput of an API endpoint")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the running API")
+    parser.add_argument("--path", default="/api/messenger/inbox", help="Endpoint to request (GET)")
+    parser.add_argument("--token", default="", help="Bearer token of a user with chats")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once")
+    parser.add_argument("--requests", type=int, default=2000, help="Total measured requests")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests sent first")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.path, args.token, args.concurrency, args.requests, args.warmup))
+
+if __name__ == "__main__":
+    main()
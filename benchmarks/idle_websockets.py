@@ -0,0 +1,112 @@
+"""Hold thousands of idle WebSockets open and watch HTTP latency.
+
+Usage:
+    python benchmarks/idle_websockets.py --token <JWT> [--sockets 10000]
+        [--url http://localhost:8000] [--ws-path /api/messenger/ws]
+        [--probe-path /api/messenger/inbox] [--ramp 500] [--hold 30]
+
+Start the API with a single worker (``uvicorn app.main:app --workers 1``),
+raise its open file limit (``ulimit -n 65536``) and, since every socket
+belongs to the token's user, lift ``WS_MAX_CONNECTIONS_PER_USER`` to at
+least ``--sockets``. Run this from another
+machine or shell with the same limit. The probe endpoint should query the
+database: if sockets kept pool connections, probe latency would jump as
+soon as about DB_POOL_SIZE + DB_MAX_OVERFLOW sockets are open. It is
+sampled with no sockets, after every ramp step and while all are held.
+"""
+import argparse
+import asyncio
+import resource
+import statistics
+import time
+from typing import List, Tuple
+
+import httpx
+import websockets
+
+async def probe(client: httpx.AsyncClient, path: str, samples: int) -> Tuple[float, float, float, int]:
+    """p50, p95 and p99 latency in ms of sequential requests, and the error count"""
+    latencies: List[float] = []
+    errors = 0
+    for _ in range(samples):
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors += 1
+        except httpx.HTTPError:
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+    return statistics.median(latencies), percentile(0.95), percentile(0.99), errors
+
+async def answer_pings(socket):
+    """Reply to server heartbeats, which evict sockets that stay silent"""
+    try:
+        async for frame in socket:
+            if '"ping"' in frame:
+                await socket.send('{"type": "pong"}')
+    except websockets.ConnectionClosed:
+        pass
+
+async def open_socket(url: str, sockets: list, readers: list, failures: List[int]):
+    try:
+        socket = await websockets.connect(url, ping_interval=None, open_timeout=30)
+    except Exception:
+        failures[0] += 1
+        return
+    sockets.append(socket)
+    readers.append(asyncio.create_task(answer_pings(socket)))
+
+async def run(args):
+    # Each socket is a file descriptor on this side too
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.sockets + 1024)), hard))
+
+    ws_url = args.url.replace("http", "ws", 1) + args.ws_path
+    if args.token:
+        ws_url += f"?token={args.token}"
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+    sockets: list = []
+    readers: list = []
+    failures = [0]
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, timeout=30) as client:
+        print(f"{'open sockets':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        p50, p95, p99, errors = await probe(client, args.probe_path, args.samples)
+        print(f"{0:>12} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>7}")
+
+        while len(sockets) + failures[0] < args.sockets:
+            step = min(args.ramp, args.sockets - len(sockets) - failures[0])
+            await asyncio.gather(*(open_socket(ws_url, sockets, readers, failures) for _ in range(step)))
+            p50, p95, p99, errors = await probe(client, args.probe_path, args.samples)
+            print(f"{len(sockets):>12} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>7}")
+
+        print(f"Holding {len(sockets)} idle sockets for {args.hold}s ({failures[0]} failed to open)")
+        deadline = time.monotonic() + args.hold
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(5, max(0, deadline - time.monotonic())))
+            p50, p95, p99, errors = await probe(client, args.probe_path, args.samples)
+            print(f"{len(sockets):>12} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>7}")
+
+    await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
+    await asyncio.gather(*readers, return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Idle WebSocket capacity and HTTP latency under load")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the running API")
+    parser.add_argument("--token", default="", help="Access token, used for the sockets and the probe")
+    parser.add_argument("--ws-path", default="/api/messenger/ws", help="WebSocket endpoint to open")
+    parser.add_argument("--probe-path", default="/api/messenger/inbox", help="HTTP endpoint sampled for latency")
+    parser.add_argument("--sockets", type=int, default=10000, help="Idle sockets to open")
+    parser.add_argument("--ramp", type=int, default=500, help="Sockets opened per step")
+    parser.add_argument("--samples", type=int, default=100, help="Probe requests per sample")
+    parser.add_argument("--hold", type=float, default=30, help="Seconds to hold all sockets open")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
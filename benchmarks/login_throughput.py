@@ -0,0 +1,112 @@
+"""Measure password hashing and login throughput, to size workers.
+
+Usage:
+    # Hashing only, in process, with the configured scheme and costs
+    python -m benchmarks.login_throughput --local [--concurrency 4] [--requests 200]
+
+    # End to end against a running API, with an existing account
+    python -m benchmarks.login_throughput --email user@example.com --password secret
+        [--url http://localhost:8000] [--concurrency 20] [--requests 500]
+
+The local mode verifies passwords through the same bounded executor as the
+API, so it shows how many logins per second one worker can sustain for a
+given PASSWORD_HASH_CONCURRENCY. The HTTP mode also reports the latency of
+a cheap endpoint probed during the run, which stays low only if hashing
+never blocks the event loop.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+def report(label: str, total: int, elapsed: float, latencies: List[float], errors: int = 0):
+    latencies = sorted(latencies)
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    print(label)
+    print(f"  throughput  {total / elapsed:10.1f} /s")
+    print(f"  latency p50 {percentile(0.50):10.1f} ms")
+    print(f"  latency p95 {percentile(0.95):10.1f} ms")
+    print(f"  latency avg {(statistics.mean(latencies) if latencies else 0.0) * 1000:10.1f} ms")
+    if errors:
+        print(f"  errors      {errors:10d}")
+
+async def timed(coro_fn, latencies: List[float]):
+    started = time.perf_counter()
+    result = await coro_fn()
+    latencies.append(time.perf_counter() - started)
+    return result
+
+async def run_local(concurrency: int, total: int):
+    from app.core.security import PasswordHasher, pwd_context
+
+    hasher = PasswordHasher(concurrency)
+    hashed = await hasher.hash("benchmark-password")
+    latencies: List[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        timed(lambda: hasher.verify_and_update("benchmark-password", hashed), latencies)
+        for _ in range(total)
+    ))
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    report(f"Password verify ({pwd_context.default_scheme()}), {total} checks, concurrency {concurrency}", total, elapsed, latencies)
+
+async def run_http(url: str, email: str, password: str, concurrency: int, total: int):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies: List[float] = []
+        probe_latencies: List[float] = []
+        errors = 0
+        done = False
+
+        async def login():
+            nonlocal errors
+            async with semaphore:
+                response = await timed(
+                    lambda: client.post("/api/v1/auth/login", json={"email": email, "password": password}),
+                    login_latencies
+                )
+                if response.status_code != 200:
+                    errors += 1
+
+        async def probe():
+            while not done:
+                await timed(lambda: client.get("/"), probe_latencies)
+                await asyncio.sleep(0.05)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+        done = True
+        await probe_task
+
+    report(f"POST /api/v1/auth/login, {total} requests, concurrency {concurrency}", total, elapsed, login_latencies, errors)
+    report("GET / during the run", len(probe_latencies), elapsed, probe_latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing and login throughput")
+    parser.add_argument("--local", action="store_true", help="Benchmark hashing in process instead of over HTTP")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the running API")
+    parser.add_argument("--email", help="Email of an existing account (HTTP mode)")
+    parser.add_argument("--password", help="Password of that account (HTTP mode)")
+    parser.add_argument("--concurrency", type=int, default=None, help="Logins in flight at once")
+    parser.add_argument("--requests", type=int, default=200, help="Total measured logins")
+    args = parser.parse_args()
+
+    if args.local:
+        from app.core.config import settings
+        asyncio.run(run_local(args.concurrency or settings.PASSWORD_HASH_CONCURRENCY, args.requests))
+    else:
+        if not args.email or not args.password:
+            parser.error("--email and --password are required unless --local is given")
+        asyncio.run(run_http(args.url, args.email, args.password, args.concurrency or 20, args.requests))
+
+if __name__ == "__main__":
+    main()
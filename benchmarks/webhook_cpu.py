@@ -0,0 +1,127 @@
+"""Measure the CPU cost of handling one webhook delivery, before and after single-parse.
+
+Usage:
+    python -m benchmarks.webhook_cpu [--messages 1 10 50] [--iterations 5000]
+
+Runs the CPU-bound part of the webhook path in process, without a database:
+signature check, parsing, logging and serializing the broadcast frames.
+
+- ``before`` replays the former handler: it parses the body twice with the
+  standard library, prints it whole, and builds frames with ``json.dumps``.
+- ``after`` parses the verified bytes once with ``app.core.json_codec`` and
+  only formats a log line for sampled deliveries. Frames are encoded with
+  the same codec.
+
+Output goes to /dev/null, so the printed numbers are CPU time, not terminal I/O.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import time
+
+from app.core import json_codec
+from app.core.logs import format_fields
+
+SECRET = b"benchmark-app-secret"
+SAMPLE_RATE = 0.01
+
+def make_delivery(messages: int) -> bytes:
+    now = int(time.time() * 1000)
+    body = {
+        "object": "page",
+        "entry": [{
+            "id": "104729381234567",
+            "time": now,
+            "messaging": [
+                {
+                    "sender": {"id": f"{7000000000000000 + i}"},
+                    "recipient": {"id": "104729381234567"},
+                    "timestamp": now + i,
+                    "message": {
+                        "mid": f"m_{'x' * 80}{i}",
+                        "text": "Hello, I ordered a pair of shoes last week and still have no tracking number. Can you help? ✓"
+                    }
+                }
+                for i in range(messages)
+            ]
+        }]
+    }
+    return json.dumps(body).encode("utf-8")
+
+def sign(payload: bytes) -> str:
+    return "sha256=" + hmac.new(SECRET, payload, hashlib.sha256).hexdigest()
+
+def verify(payload: bytes, signature: str) -> bool:
+    expected = hmac.new(SECRET, payload, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature[7:], expected)
+
+def frames_of(body: dict):
+    """Broadcast frames built for a delivery, one per message"""
+    for seq, messaging in enumerate(body["entry"][0]["messaging"], 1):
+        yield {
+            "chat_id": 42,
+            "seq": seq,
+            "type": "new_message",
+            "data": {
+                "id": 1000 + seq,
+                "content": messaging["message"]["text"],
+                "message_type": "incoming",
+                "fb_message_id": messaging["message"]["mid"],
+                "status": "received",
+                "seq": seq,
+                "timestamp": "2024-06-01T10:15:30.123456"
+            }
+        }
+
+def before(payload: bytes, signature: str, out):
+    if not verify(payload, signature):
+        raise RuntimeError("bad signature")
+    print("Signature verified...", file=out)
+    # request.json() parsed the cached body a second time
+    json.loads(payload)
+    body = json.loads(payload)
+    print(f"body: {body}", file=out)
+    for frame in frames_of(body):
+        json.dumps(frame)
+
+def after(payload: bytes, signature: str, out):
+    if not verify(payload, signature):
+        raise RuntimeError("bad signature")
+    body = json_codec.loads(payload)
+    if random.random() < SAMPLE_RATE:
+        print("webhook_received " + format_fields({"entries": len(body["entry"]), "bytes": len(payload)}), file=out)
+    for frame in frames_of(body):
+        json_codec.dumps(frame)
+
+def measure(fn, payload: bytes, signature: str, iterations: int, out) -> float:
+    """CPU microseconds per delivery"""
+    for _ in range(min(iterations, 200)):
+        fn(payload, signature, out)
+    started = time.process_time()
+    for _ in range(iterations):
+        fn(payload, signature, out)
+    return (time.process_time() - started) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-webhook CPU cost of the parse, log and broadcast path")
+    parser.add_argument("--messages", type=int, nargs="+", default=[1, 10, 50], help="Messages per delivery")
+    parser.add_argument("--iterations", type=int, default=5000, help="Deliveries timed per case")
+    args = parser.parse_args()
+
+    print(f"JSON codec: {'orjson' if json_codec.ORJSON_AVAILABLE else 'json (install orjson for the fast path)'}")
+    print(f"{'messages':>8} {'bytes':>8} {'before us':>10} {'after us':>10} {'speedup':>8}")
+    with open(os.devnull, "w") as out:
+        for messages in args.messages:
+            payload = make_delivery(messages)
+            signature = sign(payload)
+            old = measure(before, payload, signature, args.iterations, out)
+            new = measure(after, payload, signature, args.iterations, out)
+            print(f"{messages:>8} {len(payload):>8} {old:>10.1f} {new:>10.1f} {old / new:>7.1f}x")
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
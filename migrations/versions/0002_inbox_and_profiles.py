@@ -0,0 +1,50 @@
+"""Webhook inbox and customer profile tables
+
+Revision ID: 0002_inbox_and_profiles
+Revises: 0001_baseline
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_inbox_and_profiles"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "webhook_events",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("received_at", sa.DateTime(), nullable=False),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_webhook_events_id", "webhook_events", ["id"])
+    op.create_index(
+        "ix_webhook_events_unprocessed",
+        "webhook_events",
+        ["id"],
+        postgresql_where=sa.text("status != 'processed'"),
+    )
+
+    op.create_table(
+        "customer_profiles",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("page_id", sa.String(), sa.ForeignKey("facebook_pages.id"), nullable=False),
+        sa.Column("psid", sa.String(length=255), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=True),
+        sa.Column("profile_pic", sa.Text(), nullable=True),
+        sa.Column("fetched_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("page_id", "psid", name="uq_customer_profiles_page_psid"),
+    )
+    op.create_index("ix_customer_profiles_id", "customer_profiles", ["id"])
+
+def downgrade():
+    op.drop_table("customer_profiles")
+    op.drop_table("webhook_events")
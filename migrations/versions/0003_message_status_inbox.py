@@ -0,0 +1,48 @@
+"""Outgoing message delivery status and denormalized inbox columns on chats
+
+Revision ID: 0003_message_status_inbox
+Revises: 0002_inbox_and_profiles
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_message_status_inbox"
+down_revision = "0002_inbox_and_profiles"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Existing rows were all delivered: incoming ones received, outgoing ones sent
+    op.add_column(
+        "messages",
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="received"),
+    )
+    op.execute("UPDATE messages SET status = 'sent' WHERE message_type = 'outgoing'")
+    op.alter_column("messages", "status", server_default=None)
+    op.add_column("messages", sa.Column("error", sa.Text(), nullable=True))
+
+    op.add_column("chats", sa.Column("last_message_preview", sa.String(length=255), nullable=True))
+    op.add_column("chats", sa.Column("last_message_at", sa.DateTime(), nullable=True))
+    op.add_column("chats", sa.Column("last_message_type", sa.String(length=50), nullable=True))
+    op.execute(
+        """
+        UPDATE chats
+        SET last_message_preview = LEFT(latest.content, 100),
+            last_message_at = latest.timestamp,
+            last_message_type = latest.message_type
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, content, timestamp, message_type
+            FROM messages
+            ORDER BY chat_id, timestamp DESC, id DESC
+        ) AS latest
+        WHERE chats.id = latest.chat_id
+        """
+    )
+
+def downgrade():
+    op.drop_column("chats", "last_message_type")
+    op.drop_column("chats", "last_message_at")
+    op.drop_column("chats", "last_message_preview")
+    op.drop_column("messages", "error")
+    op.drop_column("messages", "status")
@@ -0,0 +1,38 @@
+"""Composite indexes for the hot lookups
+
+- chats (user_id, fb_user_id, created_at): get_or_create_chat
+- chats (user_id, last_message_at, id): inbox listing
+- messages (chat_id, timestamp, id): latest message and history pages
+- messages (fb_message_id): lookups by Facebook message id
+- facebook_pages (user_id): page of a user
+
+Indexes are built CONCURRENTLY so the tables stay writable while they build.
+
+Revision ID: 0004_hot_path_indexes
+Revises: 0003_message_status_inbox
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+
+revision = "0004_hot_path_indexes"
+down_revision = "0003_message_status_inbox"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_chats_user_id_fb_user_id_created_at", "chats", ["user_id", "fb_user_id", "created_at"]),
+    ("ix_chats_user_id_last_message_at_id", "chats", ["user_id", "last_message_at", "id"]),
+    ("ix_messages_chat_id_timestamp_id", "messages", ["chat_id", "timestamp", "id"]),
+    ("ix_messages_fb_message_id", "messages", ["fb_message_id"]),
+    ("ix_facebook_pages_user_id", "facebook_pages", ["user_id"]),
+]
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,54 @@
+"""Per-chat sequence numbers of message changes
+
+Existing messages are numbered by (timestamp, id) within their chat and
+chats.last_seq is set to the highest number. The (chat_id, seq) index is
+built CONCURRENTLY after the backfill.
+
+Revision ID: 0005_chat_sequence_numbers
+Revises: 0004_hot_path_indexes
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_chat_sequence_numbers"
+down_revision = "0004_hot_path_indexes"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("chats", sa.Column("last_seq", sa.Integer(), nullable=False, server_default="0"))
+    op.alter_column("chats", "last_seq", server_default=None)
+    op.add_column("messages", sa.Column("seq", sa.Integer(), nullable=True))
+    op.execute(
+        """
+        UPDATE messages
+        SET seq = numbered.seq
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp, id) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE messages.id = numbered.id
+        """
+    )
+    op.execute(
+        """
+        UPDATE chats
+        SET last_seq = latest.seq
+        FROM (SELECT chat_id, MAX(seq) AS seq FROM messages GROUP BY chat_id) AS latest
+        WHERE chats.id = latest.chat_id
+        """
+    )
+    op.alter_column("messages", "seq", nullable=False)
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_chat_id_seq", "messages", ["chat_id", "seq"],
+            unique=True, postgresql_concurrently=True, if_not_exists=True
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_messages_chat_id_seq", table_name="messages", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("messages", "seq")
+    op.drop_column("chats", "last_seq")
@@ -0,0 +1,21 @@
+"""Change time of messages for delta sync
+
+Existing rows keep NULL: they changed before any watermark a client can hold.
+
+Revision ID: 0006_message_updated_at
+Revises: 0005_chat_sequence_numbers
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_message_updated_at"
+down_revision = "0005_chat_sequence_numbers"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("messages", sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+def downgrade():
+    op.drop_column("messages", "updated_at")
@@ -0,0 +1,49 @@
+"""Unique incoming message ids per chat
+
+Duplicates left by redelivered webhooks are deleted first, keeping the
+oldest copy, then the partial unique index is built CONCURRENTLY. Should
+a redelivery insert a new duplicate during the build, the index is left
+invalid: run the upgrade again.
+
+Revision ID: 0007_unique_incoming_mids
+Revises: 0006_message_updated_at
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_unique_incoming_mids"
+down_revision = "0006_message_updated_at"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute(
+        """
+        DELETE FROM messages AS duplicate
+        USING messages AS original
+        WHERE duplicate.message_type = 'incoming'
+          AND original.message_type = 'incoming'
+          AND duplicate.chat_id = original.chat_id
+          AND duplicate.fb_message_id = original.fb_message_id
+          AND duplicate.id > original.id
+        """
+    )
+
+    with op.get_context().autocommit_block():
+        # A failed concurrent build leaves an invalid index behind
+        op.drop_index(
+            "ix_messages_chat_id_fb_message_id", table_name="messages",
+            postgresql_concurrently=True, if_exists=True
+        )
+        op.create_index(
+            "ix_messages_chat_id_fb_message_id", "messages", ["chat_id", "fb_message_id"],
+            unique=True, postgresql_where=sa.text("message_type = 'incoming'"), postgresql_concurrently=True
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_messages_chat_id_fb_message_id", table_name="messages",
+            postgresql_concurrently=True, if_exists=True
+        )
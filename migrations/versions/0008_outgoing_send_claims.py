@@ -0,0 +1,40 @@
+"""Send leases of pending outgoing messages
+
+Existing pending rows keep NULL, so the first worker to start re-queues
+them. The partial index is built CONCURRENTLY; if the build fails, run
+the upgrade again.
+
+Revision ID: 0008_outgoing_send_claims
+Revises: 0007_unique_incoming_mids
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_outgoing_send_claims"
+down_revision = "0007_unique_incoming_mids"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("messages", sa.Column("claimed_at", sa.DateTime(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        # A failed concurrent build leaves an invalid index behind
+        op.drop_index(
+            "ix_messages_pending_outgoing_claimed_at", table_name="messages",
+            postgresql_concurrently=True, if_exists=True
+        )
+        op.create_index(
+            "ix_messages_pending_outgoing_claimed_at", "messages", ["claimed_at"],
+            postgresql_where=sa.text("message_type = 'outgoing' AND status = 'pending'"),
+            postgresql_concurrently=True
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_messages_pending_outgoing_claimed_at", table_name="messages",
+            postgresql_concurrently=True, if_exists=True
+        )
+    op.drop_column("messages", "claimed_at")